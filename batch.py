@@ -0,0 +1,109 @@
+import json
+import logging
+from typing import List, Optional, Sequence, Tuple
+
+from executor import ExecutionResult
+
+logger = logging.getLogger(__name__)
+
+REPORT_MARKER = "BATCH_REPORT "
+
+# Runs as tests.py; user_code.py holds the submissions as a JSON list. Each one
+# is copied next to its own tests.py in a fresh directory and run in its own
+# interpreter, all of them at once with a thread waiting on each, so one
+# solution cannot see, import or outlive another.
+_DRIVER = """
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+with open(os.path.join(here, "user_code.py"), encoding="utf-8") as f:
+    solutions = json.load(f)
+
+
+def judge(index, code):
+    workdir = os.path.join(root, str(index))
+    os.mkdir(workdir)
+    for name, content in (("tests.py", TESTS), ("user_code.py", code)):
+        with open(os.path.join(workdir, name), "w", encoding="utf-8") as f:
+            f.write(content)
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "tests.py"],
+        cwd=workdir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+    try:
+        stdout, stderr = process.communicate(timeout=TIMEOUT)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(process.pid, 9)
+        except ProcessLookupError:
+            pass
+        process.communicate()
+        results[index] = {
+            "stdout": "",
+            "stderr": "Vaqt chegarasi ({}s) oshib ketdi\\n".format(TIMEOUT),
+            "error": "Timed out after {}s".format(TIMEOUT),
+            "duration": time.perf_counter() - started,
+        }
+        return
+    results[index] = {
+        "stdout": stdout[:MAX_OUTPUT].decode("utf-8", "replace"),
+        "stderr": stderr[:MAX_OUTPUT].decode("utf-8", "replace"),
+        "error": "Exit code: {}".format(process.returncode) if process.returncode else "",
+        "duration": time.perf_counter() - started,
+    }
+
+
+root = tempfile.mkdtemp(prefix="batch-")
+results = [None] * len(solutions)
+threads = [
+    threading.Thread(target=judge, args=(index, code))
+    for index, code in enumerate(solutions)
+]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+
+shutil.rmtree(root, ignore_errors=True)
+print(REPORT_MARKER + json.dumps(results))
+"""
+
+
+def build_batch(
+    tests: str, codes: Sequence[str], timeout: float = 10.0, max_output: int = 16384
+) -> Tuple[str, str]:
+    """Returns the tests.py and user_code.py that judge ``codes`` in one run."""
+    driver = (
+        f"TESTS = {tests!r}\n"
+        f"TIMEOUT = {float(timeout)!r}\n"
+        f"MAX_OUTPUT = {int(max_output)}\n"
+        f"REPORT_MARKER = {REPORT_MARKER!r}\n" + _DRIVER
+    )
+    return driver, json.dumps(list(codes))
+
+
+def parse_batch(stdout: str, count: int) -> Optional[List[ExecutionResult]]:
+    """Splits a driver run back into one result per submission."""
+    for line in reversed(stdout.splitlines()):
+        if line.startswith(REPORT_MARKER):
+            try:
+                results = json.loads(line[len(REPORT_MARKER) :])
+            except ValueError:
+                logger.warning("malformed batch report")
+                return None
+            if not isinstance(results, list) or len(results) != count:
+                logger.warning("batch report has the wrong number of results")
+                return None
+            return [ExecutionResult(**result) for result in results]
+    return None
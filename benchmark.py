@@ -0,0 +1,94 @@
+import json
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+REPORT_MARKER = "BENCHMARK_REPORT "
+
+# Runs as tests.py next to user_code.py. The challenge tests are loaded as a
+# module instead of being executed as a script, so their unittest.main() never
+# fires, and every test method is timed on a fresh TestCase instance.
+_HARNESS = """
+import json
+import statistics
+import sys
+import time
+import types
+import unittest
+
+module = types.ModuleType("challenge_tests")
+module.__file__ = "challenge_tests.py"
+sys.modules["challenge_tests"] = module
+exec(compile(TESTS, "challenge_tests.py", "exec"), module.__dict__)
+
+
+def flatten(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from flatten(test)
+        else:
+            yield test
+
+
+def summary(values):
+    return {
+        "min": min(values),
+        "median": statistics.median(values),
+        "stddev": statistics.pstdev(values),
+    }
+
+
+tests = list(flatten(unittest.defaultTestLoader.loadTestsFromModule(module)))
+outcome = unittest.TestResult()
+samples = {test.id(): [] for test in tests}
+totals = []
+
+for iteration in range(WARMUP + REPEAT):
+    total = 0.0
+    for test in tests:
+        case = type(test)(test._testMethodName)
+        started = time.perf_counter()
+        case.run(outcome)
+        elapsed = time.perf_counter() - started
+        total += elapsed
+        if iteration >= WARMUP:
+            samples[test.id()].append(elapsed)
+    if not outcome.wasSuccessful():
+        break
+    if iteration >= WARMUP:
+        totals.append(total)
+
+ok = outcome.wasSuccessful() and bool(totals)
+report = {
+    "ok": ok,
+    "repeat": REPEAT,
+    "warmup": WARMUP,
+    "tests": {name: summary(values) for name, values in samples.items() if ok},
+    "total": summary(totals) if ok else None,
+}
+print(REPORT_MARKER + json.dumps(report))
+"""
+
+
+def build_harness(tests: str, repeat: int = 5, warmup: int = 1) -> str:
+    """Wraps challenge tests in a script that times them repeatedly."""
+    return (
+        f"TESTS = {tests!r}\n"
+        f"REPEAT = {int(repeat)}\n"
+        f"WARMUP = {int(warmup)}\n"
+        f"REPORT_MARKER = {REPORT_MARKER!r}\n" + _HARNESS
+    )
+
+
+def parse_report(stdout: str) -> Optional[dict]:
+    """Returns the harness report, or None when the benchmark did not succeed."""
+    for line in reversed(stdout.splitlines()):
+        if line.startswith(REPORT_MARKER):
+            try:
+                report = json.loads(line[len(REPORT_MARKER) :])
+            except ValueError:
+                logger.warning("malformed benchmark report: {}".format(line))
+                return None
+            return report if report.get("ok") else None
+    return None
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+from aiolimiter import AsyncLimiter
+from telegram import Bot
+from telegram.constants import ParseMode
+from telegram.error import (
+    BadRequest,
+    Forbidden,
+    NetworkError,
+    RetryAfter,
+    TelegramError,
+)
+
+from database import Database
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SENT = "sent"
+BLOCKED = "blocked"
+FAILED = "failed"
+
+# BadRequest messages meaning the chat is gone for good
+_GONE = ("chat not found", "user is deactivated")
+
+
+def text_message(text: str) -> dict:
+    return {"text": text}
+
+
+def photo_message(photo_id: str, caption: Optional[str] = None) -> dict:
+    return {"photo": photo_id, "caption": caption}
+
+
+class Broadcaster:
+    """Sends one message to many chats within Telegram's flood limits.
+
+    A token bucket allows ``global_rate`` messages per second overall and
+    ``group_rate`` per minute into any one group, with at most
+    ``concurrency`` requests in flight. A RetryAfter pauses every sender for
+    the time Telegram asks for. Chats that blocked the bot or no longer exist
+    are handed to ``on_gone``. Each recipient's outcome is stored as soon as
+    it is known, so a broadcast interrupted by a restart resumes with the
+    chats it had not reached yet.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        global_rate: float = 25.0,
+        group_rate: float = 20.0,
+        concurrency: int = 8,
+        max_retries: int = 3,
+        progress_interval: float = 10.0,
+        page_size: int = 200,
+        on_gone: Optional[Callable[[int], None]] = None,
+    ) -> None:
+        self.db = db
+        self.global_rate = global_rate
+        self.group_rate = group_rate
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+        self.page_size = page_size
+        self.on_gone = on_gone
+        self._limiter = AsyncLimiter(global_rate, 1)
+        self._group_limiters: Dict[int, AsyncLimiter] = {}
+        self._paused_until = 0.0
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    async def broadcast(
+        self, bot: Bot, message: dict, recipients: Iterable[int], chat_id: int
+    ) -> int:
+        """Starts sending ``message`` and reports progress to ``chat_id``."""
+        broadcast_id = await self.db.create_broadcast(
+            json.dumps(message), chat_id, sorted(set(recipients))
+        )
+        self._start(bot, broadcast_id, message, chat_id)
+        return broadcast_id
+
+    async def resume(self, bot: Bot) -> None:
+        for row in await self.db.unfinished_broadcasts():
+            logger.info("resuming broadcast {}".format(row["id"]))
+            self._start(bot, row["id"], json.loads(row["message"]), row["chat_id"])
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _start(self, bot: Bot, broadcast_id: int, message: dict, chat_id: int) -> None:
+        task = asyncio.create_task(
+            self._broadcast(bot, broadcast_id, message, chat_id),
+            name=f"broadcast-{broadcast_id}",
+        )
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._finished(broadcast_id, task))
+
+    def _finished(self, broadcast_id: int, task: asyncio.Task) -> None:
+        self._tasks.pop(broadcast_id, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(
+                "broadcast {} failed".format(broadcast_id), exc_info=task.exception()
+            )
+
+    async def _wait_for_flood_control(self) -> None:
+        while (delay := self._paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+    async def _deliver(self, bot: Bot, chat_id: int, message: dict) -> None:
+        await self._wait_for_flood_control()
+        if chat_id < 0:
+            limiter = self._group_limiters.get(chat_id)
+            if limiter is None:
+                limiter = self._group_limiters[chat_id] = AsyncLimiter(
+                    self.group_rate, 60
+                )
+            await limiter.acquire()
+        async with self._limiter:
+            if "photo" in message:
+                await bot.send_photo(
+                    chat_id, message["photo"], caption=message.get("caption")
+                )
+            else:
+                await bot.send_message(
+                    chat_id, message["text"], parse_mode=ParseMode.HTML
+                )
+
+    async def _send(self, bot: Bot, chat_id: int, message: dict) -> str:
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._deliver(bot, chat_id, message)
+                return SENT
+            except RetryAfter as e:
+                metrics.inc("broadcast_flood_waits_total")
+                logger.warning("flood control, pausing for {}s".format(e.retry_after))
+                self._paused_until = max(
+                    self._paused_until, time.monotonic() + e.retry_after
+                )
+            except Forbidden:
+                return BLOCKED
+            except BadRequest as e:
+                if any(reason in str(e).lower() for reason in _GONE):
+                    return BLOCKED
+                logger.warning("could not send to {}: {}".format(chat_id, e))
+                return FAILED
+            except NetworkError as e:
+                logger.warning("network error sending to {}: {}".format(chat_id, e))
+                await asyncio.sleep(2**attempt)
+            except TelegramError as e:
+                logger.warning("could not send to {}: {}".format(chat_id, e))
+                return FAILED
+        return FAILED
+
+    async def _deliver_and_record(
+        self,
+        semaphore: asyncio.Semaphore,
+        bot: Bot,
+        broadcast_id: int,
+        chat_id: int,
+        message: dict,
+    ) -> str:
+        async with semaphore:
+            status = await self._send(bot, chat_id, message)
+        await self.db.mark_recipient(broadcast_id, chat_id, status)
+        metrics.inc("broadcast_messages_total", status=status)
+        if status == BLOCKED and self.on_gone is not None:
+            self.on_gone(chat_id)
+        return status
+
+    async def _report(self, bot: Bot, chat_id: int, message_id: int, text: str) -> None:
+        try:
+            await bot.edit_message_text(text, chat_id, message_id)
+        except TelegramError as e:
+            logger.warning("could not update broadcast progress: {}".format(e))
+
+    async def _broadcast(
+        self, bot: Bot, broadcast_id: int, message: dict, chat_id: int
+    ) -> None:
+        counts = await self.db.broadcast_counts(broadcast_id)
+        total = sum(counts.values())
+        done = total - counts.get(None, 0)
+        header = f"Broadcast {broadcast_id}"
+        progress = await bot.send_message(chat_id, f"{header}: {done}/{total}")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        after_chat_id = -(2**63)
+        reported = time.monotonic()
+        while True:
+            recipients = await self.db.pending_recipients(
+                broadcast_id, after_chat_id, self.page_size
+            )
+            if not recipients:
+                break
+            after_chat_id = recipients[-1]
+            await asyncio.gather(
+                *(
+                    self._deliver_and_record(
+                        semaphore, bot, broadcast_id, recipient, message
+                    )
+                    for recipient in recipients
+                )
+            )
+            done += len(recipients)
+            if time.monotonic() - reported >= self.progress_interval:
+                reported = time.monotonic()
+                await self._report(
+                    bot, chat_id, progress.message_id, f"{header}: {done}/{total}"
+                )
+
+        await self.db.finish_broadcast(broadcast_id)
+        counts = await self.db.broadcast_counts(broadcast_id)
+        await self._report(
+            bot,
+            chat_id,
+            progress.message_id,
+            f"{header} finished: {counts.get(SENT, 0)} sent, "
+            f"{counts.get(BLOCKED, 0)} blocked and removed, "
+            f"{counts.get(FAILED, 0)} failed",
+        )
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import sqlite3
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from database import Database
+from metrics import metrics
+from result_cache import tests_digest
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Challenge:
+    id: int
+    description: Optional[str]
+    solution_photo_id: Optional[str]
+    solution_text: Optional[str]
+    tests: Optional[str]
+    tests_hash: Optional[str]
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Challenge":
+        return cls(
+            id=row["id"],
+            description=row["description"],
+            solution_photo_id=row["solution_photo_id"],
+            solution_text=row["solution_text"],
+            tests=row["tests"],
+            tests_hash=tests_digest(row["tests"]) if row["tests"] else None,
+        )
+
+
+class ChallengeCache:
+    """Loads challenges from the database on demand into a bounded LRU.
+
+    Concurrent misses for the same challenge share a single query, so a burst
+    of submissions to an old challenge reads it once.
+    """
+
+    def __init__(self, db: Database, max_entries: int = 32) -> None:
+        self.db = db
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, Challenge]" = OrderedDict()
+        self._loading: Dict[int, asyncio.Future] = {}
+
+    async def get(self, challenge_id: int) -> Optional[Challenge]:
+        challenge = self._entries.get(challenge_id)
+        if challenge is not None:
+            self._entries.move_to_end(challenge_id)
+            metrics.inc("challenge_cache_total", result="hit")
+            return challenge
+
+        metrics.inc("challenge_cache_total", result="miss")
+        loading = self._loading.get(challenge_id)
+        if loading is None:
+            loading = self._loading[challenge_id] = asyncio.ensure_future(
+                self._load(challenge_id)
+            )
+            loading.add_done_callback(lambda _: self._loading.pop(challenge_id, None))
+        return await asyncio.shield(loading)
+
+    async def _load(self, challenge_id: int) -> Optional[Challenge]:
+        row = await self.db.get_challenge(challenge_id)
+        if row is None:
+            return None
+        challenge = Challenge.from_row(row)
+        self._entries[challenge_id] = challenge
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return challenge
+
+    def invalidate(self, challenge_id: int) -> None:
+        self._entries.pop(challenge_id, None)
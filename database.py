@@ -0,0 +1,1162 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from fingerprints import Fingerprint, fingerprint
+from metrics import metrics
+from preflight import token_length
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Solver columns leaderboards rank by, each backed by a (challenge_id, column)
+# index
+SOLVER_RANKINGS = ("result", "code_length")
+
+
+def solution_digest(solution: str) -> str:
+    return hashlib.sha256(solution.encode("utf-8")).hexdigest()
+
+
+def compress_solution(solution: str) -> bytes:
+    return zlib.compress(solution.encode("utf-8"), 9)
+
+
+def inflate(data: Optional[bytes]) -> Optional[str]:
+    """SQL function reading a solution stored by compress_solution."""
+    return zlib.decompress(data).decode("utf-8") if data is not None else None
+
+
+def store_fingerprint(
+    conn: sqlite3.Connection, solver_id: int, challenge_id: int, fp: Fingerprint
+) -> None:
+    """Replaces the duplicate detection rows of one solver."""
+    conn.execute("DELETE FROM solver_kgrams WHERE solver_id = ?", (solver_id,))
+    conn.execute(
+        """INSERT OR REPLACE INTO solver_fingerprints
+           (solver_id, challenge_id, ast_hash, kgrams) VALUES (?, ?, ?, ?)""",
+        (solver_id, challenge_id, fp.ast_hash, len(fp.kgrams)),
+    )
+    conn.executemany(
+        "INSERT INTO solver_kgrams (challenge_id, hash, solver_id) VALUES (?, ?, ?)",
+        [(challenge_id, kgram, solver_id) for kgram in fp.kgrams],
+    )
+
+
+def store_solution(conn: sqlite3.Connection, solution: str) -> str:
+    """Adds a solution to the shared blobs table, returns its key."""
+    key = solution_digest(solution)
+    conn.execute(
+        "INSERT OR IGNORE INTO blobs (hash, data) VALUES (?, ?)",
+        (key, compress_solution(solution)),
+    )
+    return key
+
+
+def setup_database(conn: sqlite3.Connection) -> None:
+    cursor = conn.cursor()
+    # Create users table
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            chat_id INTEGER PRIMARY KEY,
+            username TEXT,
+            full_name TEXT,
+            solved_challenges TEXT,
+            points INTEGER
+        )
+    """
+    )
+    # Create challenges table
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS challenges (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            description TEXT,
+            solution_photo_id TEXT,
+            solution_text TEXT,
+            tests TEXT
+        )
+    """
+    )
+    # Create solvers table
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS solvers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            challenge_id INTEGER,
+            user TEXT,
+            result REAL,
+            solution TEXT,
+            code_length INTEGER,
+            UNIQUE(challenge_id, user)
+        )
+    """
+    )
+    # Create solves table, one row per (user, challenge) first solve
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS solves (
+            chat_id INTEGER,
+            challenge_id INTEGER,
+            PRIMARY KEY (chat_id, challenge_id)
+        ) WITHOUT ROWID
+    """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_points ON users (points)")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_solvers_result ON solvers (challenge_id, result)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_solvers_code_length "
+        "ON solvers (challenge_id, code_length)"
+    )
+    # Create judge result cache table
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS judge_cache (
+            key TEXT PRIMARY KEY,
+            tests_hash TEXT,
+            stdout TEXT,
+            stderr TEXT,
+            error TEXT,
+            duration REAL,
+            created REAL
+        )
+    """
+    )
+    # Create re-judge tables, rejudged marks solvers already re-run
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS rejudges (
+            challenge_id INTEGER PRIMARY KEY,
+            tests_hash TEXT,
+            chat_id INTEGER,
+            started REAL,
+            finished REAL,
+            passed INTEGER,
+            failed INTEGER
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS rejudged (
+            challenge_id INTEGER,
+            solver_id INTEGER,
+            PRIMARY KEY (challenge_id, solver_id)
+        ) WITHOUT ROWID
+    """
+    )
+    # Create broadcast tables, one recipients row per chat and broadcast
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message TEXT,
+            chat_id INTEGER,
+            created REAL,
+            finished REAL
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INTEGER,
+            chat_id INTEGER,
+            status TEXT,
+            PRIMARY KEY (broadcast_id, chat_id)
+        ) WITHOUT ROWID
+    """
+    )
+    # Create solution store, zlib compressed and keyed by content hash so
+    # identical solutions share one row
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash TEXT PRIMARY KEY,
+            data BLOB
+        )
+    """
+    )
+    # Create duplicate detection index, see fingerprints.py
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS solver_fingerprints (
+            solver_id INTEGER PRIMARY KEY,
+            challenge_id INTEGER,
+            ast_hash TEXT,
+            kgrams INTEGER
+        )
+    """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_solver_fingerprints_ast_hash "
+        "ON solver_fingerprints (challenge_id, ast_hash)"
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS solver_kgrams (
+            challenge_id INTEGER,
+            hash INTEGER,
+            solver_id INTEGER,
+            PRIMARY KEY (challenge_id, hash, solver_id)
+        ) WITHOUT ROWID
+    """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_solver_kgrams_solver_id "
+        "ON solver_kgrams (solver_id)"
+    )
+    # Create error store, full details behind the digests sent to developers
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS errors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fingerprint TEXT,
+            created REAL,
+            type TEXT,
+            message TEXT,
+            traceback TEXT,
+            context TEXT
+        )
+    """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_errors_fingerprint "
+        "ON errors (fingerprint, created)"
+    )
+    migrate_database(conn)
+    # solvers.chat_id and solution_hash only exist once migrated
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_solvers_chat_id "
+        "ON solvers (challenge_id, chat_id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_solvers_solution_hash "
+        "ON solvers (solution_hash)"
+    )
+    conn.commit()
+
+
+def migrate_database(conn: sqlite3.Connection) -> None:
+    """Upgrades an existing database file, tracked with PRAGMA user_version."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    if version < 1:
+        # Move the JSON solved_challenges blobs into the solves table
+        users = conn.execute(
+            "SELECT chat_id, solved_challenges FROM users "
+            "WHERE solved_challenges IS NOT NULL"
+        ).fetchall()
+        for user in users:
+            try:
+                challenge_ids = json.loads(user["solved_challenges"])
+            except ValueError:
+                logger.warning(
+                    "skipping malformed solved_challenges of {}".format(user["chat_id"])
+                )
+                continue
+            conn.executemany(
+                "INSERT OR IGNORE INTO solves (chat_id, challenge_id) VALUES (?, ?)",
+                [(user["chat_id"], challenge_id) for challenge_id in challenge_ids],
+            )
+        conn.execute("UPDATE users SET solved_challenges = NULL")
+        conn.execute("PRAGMA user_version = 1")
+        logger.info("migrated solved_challenges of {} users".format(len(users)))
+
+    if version < 2:
+        # Benchmark report behind the median time stored in solvers.result
+        conn.execute("ALTER TABLE solvers ADD COLUMN timings TEXT")
+        conn.execute("PRAGMA user_version = 2")
+
+    if version < 3:
+        # code_length counts significant tokens instead of characters
+        solvers = conn.execute("SELECT id, solution FROM solvers").fetchall()
+        conn.executemany(
+            "UPDATE solvers SET code_length = ? WHERE id = ?",
+            [(token_length(row["solution"] or ""), row["id"]) for row in solvers],
+        )
+        conn.execute("PRAGMA user_version = 3")
+
+    if version < 4:
+        # Link solvers to users, matched on the name shown in leaderboards
+        conn.execute("ALTER TABLE solvers ADD COLUMN chat_id INTEGER")
+        conn.execute(
+            """UPDATE solvers SET chat_id = (
+                   SELECT chat_id FROM users
+                   WHERE '@' || users.username = solvers.user
+                      OR users.full_name = solvers.user
+                   ORDER BY users.username IS NULL
+                   LIMIT 1
+               )"""
+        )
+        conn.execute("PRAGMA user_version = 4")
+
+    if version < 5:
+        # Move solution texts into the compressed, shared blobs table
+        conn.execute("ALTER TABLE solvers ADD COLUMN solution_hash TEXT")
+        solvers = conn.execute(
+            "SELECT id, solution FROM solvers WHERE solution IS NOT NULL"
+        ).fetchall()
+        conn.executemany(
+            "UPDATE solvers SET solution_hash = ?, solution = NULL WHERE id = ?",
+            [(store_solution(conn, row["solution"]), row["id"]) for row in solvers],
+        )
+        conn.execute("PRAGMA user_version = 5")
+        logger.info("moved {} solutions into blobs".format(len(solvers)))
+
+    if version < 6:
+        # Fingerprint the solutions stored before duplicate detection
+        solvers = conn.execute(
+            """SELECT solvers.id, challenge_id, inflate(blobs.data) AS solution
+               FROM solvers JOIN blobs ON blobs.hash = solution_hash"""
+        )
+        count = 0
+        for row in solvers:
+            store_fingerprint(
+                conn, row["id"], row["challenge_id"], fingerprint(row["solution"])
+            )
+            count += 1
+        conn.execute("PRAGMA user_version = 6")
+        logger.info("fingerprinted {} solutions".format(count))
+
+
+@dataclass
+class Solve:
+    """An accepted submission waiting to be recorded."""
+
+    chat_id: int
+    challenge_id: int
+    username: str
+    result: float
+    solution: str
+    code_length: int
+    timings: Optional[str] = None
+    fingerprint: Optional[Fingerprint] = None
+
+
+class Database:
+    """Long-lived SQLite access for the bot.
+
+    Writes go through one persistent connection on a dedicated thread, reads
+    through a small pool of reader threads that each keep their own
+    connection. The database runs in WAL mode so readers never wait for the
+    writer, and every query is awaited instead of blocking the event loop.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        readers: int = 2,
+        cache_size_kib: int = 16 * 1024,
+        mmap_size: int = 64 * 1024 * 1024,
+        busy_timeout: float = 5.0,
+    ) -> None:
+        self.path = path
+        self.readers = readers
+        self.cache_size_kib = cache_size_kib
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._reader_pool: Optional[ThreadPoolExecutor] = None
+
+    def setup(self) -> None:
+        """Creates and migrates the schema, then switches the file to WAL."""
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        conn.create_function("inflate", 1, inflate, deterministic=True)
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+            setup_database(conn)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            cached_statements=256,
+            check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.create_function("inflate", 1, inflate, deterministic=True)
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kib)}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        self._connections.append(conn)
+        return conn
+
+    def _connection(self) -> sqlite3.Connection:
+        # Every worker thread lazily opens one connection and reuses it, so
+        # its prepared statement cache survives between queries.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _start(self) -> None:
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(1, thread_name_prefix="db-writer")
+            self._reader_pool = ThreadPoolExecutor(
+                self.readers, thread_name_prefix="db-reader"
+            )
+
+    async def close(self) -> None:
+        if self._writer is None:
+            return
+        self._writer.shutdown(wait=True)
+        self._reader_pool.shutdown(wait=True)
+        self._writer = self._reader_pool = None
+        for conn in self._connections:
+            conn.close()
+        self._connections.clear()
+        self._local = threading.local()
+
+    async def read(self, query: Callable[..., T], *args: Any) -> T:
+        """Runs ``query(conn, *args)`` on a reader connection."""
+        self._start()
+        loop = asyncio.get_running_loop()
+        with metrics.timer("db_query_seconds", kind="read"):
+            return await loop.run_in_executor(
+                self._reader_pool, lambda: query(self._connection(), *args)
+            )
+
+    async def write(self, query: Callable[..., T], *args: Any) -> T:
+        """Runs ``query(conn, *args)`` in a transaction on the writer connection."""
+        self._start()
+
+        def transaction() -> T:
+            conn = self._connection()
+            with conn:
+                return query(conn, *args)
+
+        loop = asyncio.get_running_loop()
+        with metrics.timer("db_query_seconds", kind="write"):
+            return await loop.run_in_executor(self._writer, transaction)
+
+    # Users
+
+    async def add_user(self, chat_id: int, username: str, full_name: str) -> None:
+        await self.write(
+            lambda conn: conn.execute(
+                "INSERT OR IGNORE INTO users (chat_id, username, full_name, points) "
+                "VALUES (?, ?, ?, 0)",
+                (chat_id, username, full_name),
+            )
+        )
+
+    async def users_page(
+        self,
+        after: Optional[Tuple[int, int]] = None,
+        before: Optional[Tuple[int, int]] = None,
+        limit: int = 10,
+    ) -> List[sqlite3.Row]:
+        """Users with points, best first, strictly after or before a key.
+
+        Keys are ``(points, chat_id)`` pairs taken from the edge of the
+        previous page, so every page is an index range scan.
+        """
+
+        def query(conn: sqlite3.Connection) -> List[sqlite3.Row]:
+            if before is not None:
+                rows = conn.execute(
+                    """SELECT * FROM users
+                       WHERE points > 0
+                         AND (points > ? OR (points = ? AND chat_id < ?))
+                       ORDER BY points ASC, chat_id DESC LIMIT ?""",
+                    (before[0], before[0], before[1], limit),
+                ).fetchall()
+                return rows[::-1]
+            points, chat_id = after if after is not None else (float("inf"), 0)
+            return conn.execute(
+                """SELECT * FROM users
+                   WHERE points > 0
+                     AND (points < ? OR (points = ? AND chat_id > ?))
+                   ORDER BY points DESC, chat_id ASC LIMIT ?""",
+                (points, points, chat_id, limit),
+            ).fetchall()
+
+        return await self.read(query)
+
+    async def user_rank(self, chat_id: int) -> Optional[Tuple[int, sqlite3.Row]]:
+        """1-based place of a user in users_page order, None without points."""
+
+        def query(conn: sqlite3.Connection) -> Optional[Tuple[int, sqlite3.Row]]:
+            user = conn.execute(
+                "SELECT * FROM users WHERE chat_id = ? AND points > 0", (chat_id,)
+            ).fetchone()
+            if user is None:
+                return None
+            ahead = conn.execute(
+                "SELECT COUNT(*) FROM users WHERE points > ? "
+                "OR (points = ? AND chat_id < ?)",
+                (user["points"], user["points"], chat_id),
+            ).fetchone()[0]
+            return ahead + 1, user
+
+        return await self.read(query)
+
+    # Challenges
+
+    async def add_challenge(
+        self,
+        description: str,
+        solution_photo_id: str,
+        solution_text: str,
+        tests: str,
+    ) -> int:
+        return await self.write(
+            lambda conn: conn.execute(
+                "INSERT INTO challenges (description, solution_photo_id, solution_text, tests) "
+                "VALUES (?, ?, ?, ?)",
+                (description, solution_photo_id, solution_text, tests),
+            ).lastrowid
+        )
+
+    async def get_challenge(self, challenge_id: int) -> Optional[sqlite3.Row]:
+        return await self.read(
+            lambda conn: conn.execute(
+                "SELECT * FROM challenges WHERE id = ?", (challenge_id,)
+            ).fetchone()
+        )
+
+    async def update_challenge_tests(self, challenge_id: int, tests: str) -> bool:
+        return await self.write(
+            lambda conn: conn.execute(
+                "UPDATE challenges SET tests = ? WHERE id = ?", (tests, challenge_id)
+            ).rowcount
+            > 0
+        )
+
+    async def latest_challenge_id(self) -> Optional[int]:
+        row = await self.read(
+            lambda conn: conn.execute("SELECT MAX(id) FROM challenges").fetchone()
+        )
+        return row[0]
+
+    # Solvers
+
+    async def record_solves(self, solves: List["Solve"]) -> int:
+        """Stores accepted solutions in one transaction.
+
+        The first solve of a challenge earns the user a point. A later solve
+        replaces the user's solvers row only when it is faster or shorter, so
+        resubmitting the same code writes nothing but the solves check.
+        Returns the number of solvers rows written.
+        """
+
+        def query(conn: sqlite3.Connection) -> int:
+            written = 0
+            for solve in solves:
+                cursor = conn.execute(
+                    """INSERT OR IGNORE INTO solves (chat_id, challenge_id)
+                       SELECT chat_id, ? FROM users WHERE chat_id = ?""",
+                    (solve.challenge_id, solve.chat_id),
+                )
+                if cursor.rowcount:
+                    conn.execute(
+                        "UPDATE users SET points = points + 1 WHERE chat_id = ?",
+                        (solve.chat_id,),
+                    )
+                key = solution_digest(solve.solution)
+                cursor = conn.execute(
+                    """INSERT INTO solvers
+                       (challenge_id, chat_id, user, result, solution_hash,
+                        code_length, timings)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT (challenge_id, user) DO UPDATE SET
+                           chat_id = excluded.chat_id,
+                           result = excluded.result,
+                           solution = NULL,
+                           solution_hash = excluded.solution_hash,
+                           code_length = excluded.code_length,
+                           timings = excluded.timings
+                       WHERE solvers.result IS NULL
+                          OR excluded.result < solvers.result
+                          OR excluded.code_length < solvers.code_length""",
+                    (
+                        solve.challenge_id,
+                        solve.chat_id,
+                        solve.username,
+                        solve.result,
+                        key,
+                        solve.code_length,
+                        solve.timings,
+                    ),
+                )
+                if cursor.rowcount:
+                    store_solution(conn, solve.solution)
+                    solver_id = conn.execute(
+                        "SELECT id FROM solvers WHERE challenge_id = ? AND user = ?",
+                        (solve.challenge_id, solve.username),
+                    ).fetchone()[0]
+                    store_fingerprint(
+                        conn,
+                        solver_id,
+                        solve.challenge_id,
+                        solve.fingerprint or fingerprint(solve.solution),
+                    )
+                    written += 1
+            return written
+
+        written = await self.write(query)
+        metrics.inc("solver_writes_total", len(solves) - written, result="skipped")
+        metrics.inc("solver_writes_total", written, result="written")
+        return written
+
+    async def solvers_page(
+        self,
+        challenge_id: int,
+        column: str,
+        after: Optional[Tuple[float, int]] = None,
+        before: Optional[Tuple[float, int]] = None,
+        limit: int = 10,
+    ) -> List[sqlite3.Row]:
+        """Solvers of a challenge by ``column`` ascending, keyed on (column, id)."""
+        if column not in SOLVER_RANKINGS:
+            raise ValueError(f"cannot rank solvers by {column}")
+
+        def query(conn: sqlite3.Connection) -> List[sqlite3.Row]:
+            if before is not None:
+                rows = conn.execute(
+                    f"""SELECT * FROM solvers
+                        WHERE challenge_id = ? AND ({column}, id) < (?, ?)
+                        ORDER BY {column} DESC, id DESC LIMIT ?""",
+                    (challenge_id, *before, limit),
+                ).fetchall()
+                return rows[::-1]
+            key = after if after is not None else (float("-inf"), 0)
+            return conn.execute(
+                f"""SELECT * FROM solvers
+                    WHERE challenge_id = ? AND ({column}, id) > (?, ?)
+                    ORDER BY {column} ASC, id ASC LIMIT ?""",
+                (challenge_id, *key, limit),
+            ).fetchall()
+
+        return await self.read(query)
+
+    async def solver_rank(
+        self, challenge_id: int, chat_id: int, column: str
+    ) -> Optional[Tuple[int, sqlite3.Row]]:
+        """1-based place of a user's solution in solvers_page order."""
+        if column not in SOLVER_RANKINGS:
+            raise ValueError(f"cannot rank solvers by {column}")
+
+        def query(conn: sqlite3.Connection) -> Optional[Tuple[int, sqlite3.Row]]:
+            solver = conn.execute(
+                "SELECT * FROM solvers WHERE challenge_id = ? AND chat_id = ?",
+                (challenge_id, chat_id),
+            ).fetchone()
+            if solver is None:
+                return None
+            ahead = conn.execute(
+                f"SELECT COUNT(*) FROM solvers "
+                f"WHERE challenge_id = ? AND ({column}, id) < (?, ?)",
+                (challenge_id, solver[column], solver["id"]),
+            ).fetchone()[0]
+            return ahead + 1, solver
+
+        return await self.read(query)
+
+    # Duplicate detection
+
+    async def exact_duplicates(self, challenge_id: int) -> List[List[str]]:
+        """Users of each group of solutions with the same canonical AST."""
+
+        def query(conn: sqlite3.Connection) -> List[List[str]]:
+            rows = conn.execute(
+                """SELECT ast_hash, user FROM solver_fingerprints
+                   JOIN solvers ON solvers.id = solver_id
+                   WHERE solver_fingerprints.challenge_id = ? AND ast_hash IN (
+                       SELECT ast_hash FROM solver_fingerprints
+                       WHERE challenge_id = ? AND ast_hash IS NOT NULL
+                       GROUP BY ast_hash HAVING COUNT(*) > 1
+                   )
+                   ORDER BY ast_hash, solvers.id""",
+                (challenge_id, challenge_id),
+            )
+            groups: Dict[str, List[str]] = {}
+            for row in rows:
+                groups.setdefault(row["ast_hash"], []).append(row["user"])
+            return sorted(groups.values(), key=len, reverse=True)
+
+        return await self.read(query)
+
+    async def near_duplicates(
+        self,
+        challenge_id: int,
+        threshold: float = 0.8,
+        max_share: float = 0.5,
+        limit: int = 50,
+    ) -> List[sqlite3.Row]:
+        """Pairs of solvers sharing at least ``threshold`` of their k-grams.
+
+        Similarity is the share of the smaller solution's k-grams found in the
+        other. K-grams found in more than ``max_share`` of a challenge's
+        solutions are boilerplate and never count as shared, which also keeps
+        the self-join from growing quadratically.
+        Pairs with the same canonical AST are left to exact_duplicates.
+        """
+
+        def query(conn: sqlite3.Connection) -> List[sqlite3.Row]:
+            solvers = conn.execute(
+                "SELECT COUNT(*) FROM solver_fingerprints WHERE challenge_id = ?",
+                (challenge_id,),
+            ).fetchone()[0]
+            max_solvers = max(2, int(solvers * max_share))
+            return conn.execute(
+                """WITH rare AS (
+                       SELECT hash FROM solver_kgrams WHERE challenge_id = :challenge
+                       GROUP BY hash HAVING COUNT(*) BETWEEN 2 AND :max_solvers
+                   ),
+                   pairs AS (
+                       SELECT a.solver_id AS a, b.solver_id AS b,
+                              COUNT(*) AS shared
+                       FROM solver_kgrams a JOIN solver_kgrams b
+                         ON b.challenge_id = a.challenge_id AND b.hash = a.hash
+                        AND b.solver_id > a.solver_id
+                       WHERE a.challenge_id = :challenge AND a.hash IN rare
+                       GROUP BY a.solver_id, b.solver_id
+                   )
+                   SELECT sa.user AS user_a, sb.user AS user_b,
+                          shared * 1.0 / MIN(fa.kgrams, fb.kgrams) AS similarity
+                   FROM pairs
+                   JOIN solvers sa ON sa.id = pairs.a
+                   JOIN solvers sb ON sb.id = pairs.b
+                   JOIN solver_fingerprints fa ON fa.solver_id = pairs.a
+                   JOIN solver_fingerprints fb ON fb.solver_id = pairs.b
+                   WHERE similarity >= :threshold
+                     AND fa.ast_hash IS NOT fb.ast_hash
+                   ORDER BY similarity DESC LIMIT :limit""",
+                {
+                    "challenge": challenge_id,
+                    "max_solvers": max_solvers,
+                    "threshold": threshold,
+                    "limit": limit,
+                },
+            ).fetchall()
+
+        return await self.read(query)
+
+    # Re-judging
+
+    async def start_rejudge(
+        self, challenge_id: int, tests_hash: str, chat_id: int
+    ) -> bool:
+        """Opens a re-judge of a challenge, returns True when resuming one.
+
+        An unfinished re-judge against the same tests keeps its progress,
+        anything else starts over.
+        """
+
+        def query(conn: sqlite3.Connection) -> bool:
+            row = conn.execute(
+                "SELECT tests_hash, finished FROM rejudges WHERE challenge_id = ?",
+                (challenge_id,),
+            ).fetchone()
+            if row and row["finished"] is None and row["tests_hash"] == tests_hash:
+                conn.execute(
+                    "UPDATE rejudges SET chat_id = ? WHERE challenge_id = ?",
+                    (chat_id, challenge_id),
+                )
+                return True
+            conn.execute("DELETE FROM rejudged WHERE challenge_id = ?", (challenge_id,))
+            conn.execute(
+                """INSERT OR REPLACE INTO rejudges
+                   (challenge_id, tests_hash, chat_id, started, finished, passed,
+                    failed)
+                   VALUES (?, ?, ?, ?, NULL, 0, 0)""",
+                (challenge_id, tests_hash, chat_id, time.time()),
+            )
+            return False
+
+        return await self.write(query)
+
+    async def unfinished_rejudges(self) -> List[sqlite3.Row]:
+        return await self.read(
+            lambda conn: conn.execute(
+                "SELECT * FROM rejudges WHERE finished IS NULL"
+            ).fetchall()
+        )
+
+    async def rejudge_candidates(
+        self, challenge_id: int, after_id: int, limit: int
+    ) -> List[sqlite3.Row]:
+        """Next solvers of a challenge not re-judged yet, in id order."""
+        return await self.read(
+            lambda conn: conn.execute(
+                """SELECT id, chat_id, user,
+                          COALESCE(solution, inflate(blobs.data)) AS solution
+                   FROM solvers LEFT JOIN blobs ON blobs.hash = solution_hash
+                   WHERE challenge_id = ? AND id > ? AND NOT EXISTS (
+                       SELECT 1 FROM rejudged
+                       WHERE rejudged.challenge_id = solvers.challenge_id
+                         AND rejudged.solver_id = solvers.id
+                   )
+                   ORDER BY id LIMIT ?""",
+                (challenge_id, after_id, limit),
+            ).fetchall()
+        )
+
+    async def apply_rejudge(
+        self,
+        challenge_id: int,
+        solver_id: int,
+        chat_id: Optional[int],
+        accepted: bool,
+        result: Optional[float] = None,
+        timings: Optional[str] = None,
+    ) -> None:
+        """Stores one re-judged solver and marks it done in one transaction.
+
+        A solution that no longer passes loses its solvers row, and the user
+        loses the point the solve earned.
+        """
+
+        def query(conn: sqlite3.Connection) -> None:
+            if accepted:
+                conn.execute(
+                    "UPDATE solvers SET result = ?, timings = ? WHERE id = ?",
+                    (result, timings, solver_id),
+                )
+            else:
+                conn.execute("DELETE FROM solvers WHERE id = ?", (solver_id,))
+                conn.execute(
+                    "DELETE FROM solver_fingerprints WHERE solver_id = ?", (solver_id,)
+                )
+                conn.execute(
+                    "DELETE FROM solver_kgrams WHERE solver_id = ?", (solver_id,)
+                )
+                cursor = conn.execute(
+                    "DELETE FROM solves WHERE chat_id = ? AND challenge_id = ?",
+                    (chat_id, challenge_id),
+                )
+                if cursor.rowcount:
+                    conn.execute(
+                        "UPDATE users SET points = points - 1 WHERE chat_id = ?",
+                        (chat_id,),
+                    )
+            counter = "passed" if accepted else "failed"
+            conn.execute(
+                f"UPDATE rejudges SET {counter} = {counter} + 1 WHERE challenge_id = ?",
+                (challenge_id,),
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO rejudged (challenge_id, solver_id) VALUES (?, ?)",
+                (challenge_id, solver_id),
+            )
+
+        await self.write(query)
+
+    async def count_rejudge_candidates(self, challenge_id: int) -> int:
+        return await self.read(
+            lambda conn: conn.execute(
+                """SELECT COUNT(*) FROM solvers
+                   WHERE challenge_id = ? AND NOT EXISTS (
+                       SELECT 1 FROM rejudged
+                       WHERE rejudged.challenge_id = solvers.challenge_id
+                         AND rejudged.solver_id = solvers.id
+                   )""",
+                (challenge_id,),
+            ).fetchone()[0]
+        )
+
+    async def finish_rejudge(self, challenge_id: int) -> Optional[sqlite3.Row]:
+        def query(conn: sqlite3.Connection) -> Optional[sqlite3.Row]:
+            conn.execute(
+                "UPDATE rejudges SET finished = ? WHERE challenge_id = ?",
+                (time.time(), challenge_id),
+            )
+            conn.execute("DELETE FROM rejudged WHERE challenge_id = ?", (challenge_id,))
+            return conn.execute(
+                "SELECT * FROM rejudges WHERE challenge_id = ?", (challenge_id,)
+            ).fetchone()
+
+        return await self.write(query)
+
+    # Broadcasts
+
+    async def create_broadcast(
+        self, message: str, chat_id: int, recipients: List[int]
+    ) -> int:
+        """Stores a broadcast with every recipient pending, returns its id."""
+
+        def query(conn: sqlite3.Connection) -> int:
+            broadcast_id = conn.execute(
+                "INSERT INTO broadcasts (message, chat_id, created) VALUES (?, ?, ?)",
+                (message, chat_id, time.time()),
+            ).lastrowid
+            conn.executemany(
+                "INSERT OR IGNORE INTO broadcast_recipients "
+                "(broadcast_id, chat_id, status) VALUES (?, ?, NULL)",
+                [(broadcast_id, recipient) for recipient in recipients],
+            )
+            return broadcast_id
+
+        return await self.write(query)
+
+    async def unfinished_broadcasts(self) -> List[sqlite3.Row]:
+        return await self.read(
+            lambda conn: conn.execute(
+                "SELECT * FROM broadcasts WHERE finished IS NULL ORDER BY id"
+            ).fetchall()
+        )
+
+    async def pending_recipients(
+        self, broadcast_id: int, after_chat_id: int, limit: int
+    ) -> List[int]:
+        rows = await self.read(
+            lambda conn: conn.execute(
+                """SELECT chat_id FROM broadcast_recipients
+                   WHERE broadcast_id = ? AND chat_id > ? AND status IS NULL
+                   ORDER BY chat_id LIMIT ?""",
+                (broadcast_id, after_chat_id, limit),
+            ).fetchall()
+        )
+        return [row["chat_id"] for row in rows]
+
+    async def mark_recipient(
+        self, broadcast_id: int, chat_id: int, status: str
+    ) -> None:
+        await self.write(
+            lambda conn: conn.execute(
+                "UPDATE broadcast_recipients SET status = ? "
+                "WHERE broadcast_id = ? AND chat_id = ?",
+                (status, broadcast_id, chat_id),
+            )
+        )
+
+    async def broadcast_counts(self, broadcast_id: int) -> Dict[Optional[str], int]:
+        rows = await self.read(
+            lambda conn: conn.execute(
+                "SELECT status, COUNT(*) FROM broadcast_recipients "
+                "WHERE broadcast_id = ? GROUP BY status",
+                (broadcast_id,),
+            ).fetchall()
+        )
+        return {row[0]: row[1] for row in rows}
+
+    async def finish_broadcast(self, broadcast_id: int) -> None:
+        await self.write(
+            lambda conn: conn.execute(
+                "UPDATE broadcasts SET finished = ? WHERE id = ?",
+                (time.time(), broadcast_id),
+            )
+        )
+
+    # Errors
+
+    async def store_error(
+        self,
+        fingerprint: str,
+        type_name: str,
+        message: str,
+        traceback: str,
+        context: str,
+        keep: int = 10000,
+    ) -> int:
+        """Stores one error and drops the oldest beyond the last ``keep``."""
+
+        def query(conn: sqlite3.Connection) -> int:
+            error_id = conn.execute(
+                """INSERT INTO errors
+                   (fingerprint, created, type, message, traceback, context)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (fingerprint, time.time(), type_name, message, traceback, context),
+            ).lastrowid
+            if error_id % 100 == 0:
+                conn.execute("DELETE FROM errors WHERE id <= ?", (error_id - keep,))
+            return error_id
+
+        return await self.write(query)
+
+    async def get_error(self, error_id: int) -> Optional[sqlite3.Row]:
+        return await self.read(
+            lambda conn: conn.execute(
+                "SELECT * FROM errors WHERE id = ?", (error_id,)
+            ).fetchone()
+        )
+
+    async def recent_errors(self, since: float, limit: int = 20) -> List[sqlite3.Row]:
+        """Fingerprints seen since a time, most frequent first."""
+        return await self.read(
+            lambda conn: conn.execute(
+                """SELECT fingerprint, type, message, COUNT(*) AS count,
+                          MAX(id) AS last_id
+                   FROM errors WHERE created >= ?
+                   GROUP BY fingerprint ORDER BY count DESC LIMIT ?""",
+                (since, limit),
+            ).fetchall()
+        )
+
+    # Maintenance
+
+    async def compact(self) -> Tuple[int, int]:
+        """Drops unreferenced solutions and VACUUMs the file.
+
+        Solutions still stored inline by an interrupted migration are moved
+        into blobs first. Returns the database size in bytes before and after.
+        """
+
+        def size() -> int:
+            return sum(
+                os.path.getsize(path)
+                for path in (self.path, self.path + "-wal")
+                if os.path.exists(path)
+            )
+
+        def collect(conn: sqlite3.Connection) -> int:
+            solvers = conn.execute(
+                "SELECT id, solution FROM solvers WHERE solution IS NOT NULL"
+            ).fetchall()
+            conn.executemany(
+                "UPDATE solvers SET solution_hash = ?, solution = NULL WHERE id = ?",
+                [(store_solution(conn, row["solution"]), row["id"]) for row in solvers],
+            )
+            return conn.execute(
+                """DELETE FROM blobs WHERE NOT EXISTS (
+                       SELECT 1 FROM solvers WHERE solution_hash = blobs.hash
+                   )"""
+            ).rowcount
+
+        def vacuum(conn: sqlite3.Connection) -> None:
+            # VACUUM cannot run inside a transaction, write() only opens one
+            # on the first data change
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        before = size()
+        dropped = await self.write(collect)
+        await self.write(vacuum)
+        after = size()
+        logger.info(
+            "compacted database: dropped {} solutions, {} -> {} bytes".format(
+                dropped, before, after
+            )
+        )
+        return before, after
+
+    # Judge cache
+
+    async def get_cached_result(self, key: str) -> Optional[sqlite3.Row]:
+        return await self.read(
+            lambda conn: conn.execute(
+                "SELECT * FROM judge_cache WHERE key = ?", (key,)
+            ).fetchone()
+        )
+
+    async def store_cached_result(
+        self,
+        key: str,
+        tests_hash: str,
+        stdout: str,
+        stderr: str,
+        error: str,
+        duration: float,
+        created: float,
+    ) -> None:
+        await self.write(
+            lambda conn: conn.execute(
+                """INSERT OR REPLACE INTO judge_cache
+                   (key, tests_hash, stdout, stderr, error, duration, created)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (key, tests_hash, stdout, stderr, error, duration, created),
+            )
+        )
+
+    async def delete_cached_result(self, key: str) -> None:
+        await self.write(
+            lambda conn: conn.execute("DELETE FROM judge_cache WHERE key = ?", (key,))
+        )
+
+    async def clear_cached_results(self) -> None:
+        await self.write(lambda conn: conn.execute("DELETE FROM judge_cache"))
+
+
+class SolveBuffer:
+    """Write-behind buffer that group-commits accepted solutions.
+
+    Solves are flushed in a single transaction once ``max_records`` are
+    pending or ``max_delay`` seconds after the first one arrived, whichever
+    comes first. ``sync`` lets a reader wait until a chat's own solves are
+    committed. ``on_commit`` is called with every batch once it is stored.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        max_records: int = 50,
+        max_delay: float = 0.2,
+        on_commit: Optional[Callable[[List[Solve]], None]] = None,
+    ):
+        self.db = db
+        self.max_records = max_records
+        self.max_delay = max_delay
+        self.on_commit = on_commit
+        self._pending: List[Solve] = []
+        self._in_flight: List[Solve] = []
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+
+    async def add(self, solve: Solve) -> None:
+        self._pending.append(solve)
+        if len(self._pending) >= self.max_records:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.max_delay)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("failed to flush buffered solves")
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._pending:
+                return
+            self._in_flight, self._pending = self._pending, []
+            try:
+                await self.db.record_solves(self._in_flight)
+                if self.on_commit is not None:
+                    self.on_commit(self._in_flight)
+            except BaseException:
+                # Keep the batch so the next flush retries it
+                self._pending[:0] = self._in_flight
+                raise
+            finally:
+                self._in_flight = []
+
+    def has_pending(self, chat_id: Optional[int] = None) -> bool:
+        return any(
+            chat_id is None or solve.chat_id == chat_id
+            for solve in self._pending + self._in_flight
+        )
+
+    async def sync(self, chat_id: Optional[int] = None) -> None:
+        """Flushes if the chat (or anyone, without a chat) has uncommitted solves."""
+        if self.has_pending(chat_id):
+            await self.flush()
+
+    async def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
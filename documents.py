@@ -0,0 +1,72 @@
+import logging
+from typing import Optional
+
+import httpx
+from telegram import Bot, Document
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentTooLarge(Exception):
+    """Raised when an uploaded document exceeds the byte cap."""
+
+    def __init__(self, limit: int) -> None:
+        super().__init__(f"document is larger than {limit} bytes")
+        self.limit = limit
+
+
+class DocumentDecodeError(Exception):
+    """Raised when an uploaded document is not valid UTF-8 text."""
+
+    def __init__(self, error: UnicodeDecodeError, content: bytes) -> None:
+        line = content.count(b"\n", 0, error.start) + 1
+        super().__init__(f"invalid UTF-8 at line {line}")
+        self.line = line
+
+
+class DocumentDownloader:
+    """Streams Telegram documents into memory with a hard size cap.
+
+    Documents whose announced size is already over the cap are rejected
+    before they are requested, and streaming stops as soon as the cap is
+    crossed, so a large upload never gets buffered whole.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024, timeout: float = 30.0) -> None:
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def fetch_text(
+        self, bot: Bot, document: Document, max_bytes: Optional[int] = None
+    ) -> str:
+        limit = max_bytes or self.max_bytes
+        if document.file_size and document.file_size > limit:
+            raise DocumentTooLarge(limit)
+
+        await self.start()
+        file = await bot.get_file(document.file_id)
+        if file.file_size and file.file_size > limit:
+            raise DocumentTooLarge(limit)
+
+        content = bytearray()
+        async with self._client.stream("GET", file.file_path) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                content += chunk
+                if len(content) > limit:
+                    raise DocumentTooLarge(limit)
+
+        try:
+            return content.decode("utf-8-sig")
+        except UnicodeDecodeError as e:
+            raise DocumentDecodeError(e, bytes(content)) from e
@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import html
+import json
+import logging
+import os
+import time
+import traceback
+from typing import Dict, Optional, Union
+
+from aiolimiter import AsyncLimiter
+from telegram import Bot
+from telegram.constants import MessageLimit, ParseMode
+from telegram.error import TelegramError
+
+from database import Database
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def fingerprint(error: BaseException) -> str:
+    """Stable id of an error: its type and where it was raised in our code.
+
+    Frames outside the project (the library, asyncio) are skipped, so the same
+    bug reached through different call paths inside the library still matches.
+    """
+    frames = [
+        frame
+        for frame in traceback.extract_tb(error.__traceback__)
+        if frame.filename.startswith(_ROOT)
+    ] or traceback.extract_tb(error.__traceback__)[-1:]
+    location = ";".join(
+        f"{os.path.basename(frame.filename)}:{frame.name}:{frame.lineno}"
+        for frame in frames[-3:]
+    )
+    key = f"{type(error).__module__}.{type(error).__qualname__}|{location}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def truncate(text: str, limit: int) -> str:
+    """Keeps the end of ``text``, where tracebacks say what went wrong."""
+    if len(text) <= limit:
+        return text
+    return "…" + text[len(text) - limit + 1 :]
+
+
+class _Window:
+    __slots__ = ("started", "count", "last_id", "flush")
+
+    def __init__(self, last_id: Optional[int]) -> None:
+        self.started = time.monotonic()
+        self.count = 0
+        self.last_id = last_id
+        self.flush: Optional[asyncio.Task] = None
+
+
+class ErrorReporter:
+    """Coalesces errors into rate-limited digests for the developer chat.
+
+    Every error is stored in full in the ``errors`` table. The first error of
+    a fingerprint is reported right away, repeats within ``window`` seconds
+    are only counted and summed up in one message when the window closes. At
+    most ``max_messages`` reports are sent per minute; beyond that errors are
+    still stored and counted but not sent.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        chat_id: Union[int, str],
+        window: float = 300.0,
+        max_messages: int = 20,
+    ) -> None:
+        self.db = db
+        self.chat_id = chat_id
+        self.window = window
+        self._limiter = AsyncLimiter(max_messages, 60)
+        self._windows: Dict[str, _Window] = {}
+
+    async def close(self) -> None:
+        for entry in self._windows.values():
+            if entry.flush is not None:
+                entry.flush.cancel()
+        self._windows.clear()
+
+    async def report(
+        self, bot: Bot, error: BaseException, context: Dict[str, object]
+    ) -> None:
+        key = fingerprint(error)
+        try:
+            error_id = await self.db.store_error(
+                key,
+                type(error).__name__,
+                str(error),
+                "".join(traceback.format_exception(None, error, error.__traceback__)),
+                json.dumps(context, indent=2, ensure_ascii=False, default=str),
+            )
+        except Exception:
+            # The database may be what is failing, the digest still goes out
+            logger.exception("could not store error")
+            error_id = None
+        metrics.inc("errors_total", error=type(error).__name__)
+
+        entry = self._windows.get(key)
+        if entry is not None:
+            entry.count += 1
+            entry.last_id = error_id or entry.last_id
+            return
+
+        entry = self._windows[key] = _Window(error_id)
+        entry.flush = asyncio.create_task(self._close_window(bot, key, entry))
+        await self._send(bot, self._first_report(key, error, error_id))
+
+    def _first_report(
+        self, key: str, error: BaseException, error_id: Optional[int]
+    ) -> str:
+        header = (
+            f"<b>{html.escape(type(error).__name__)}</b> [{key}]\n"
+            f"{html.escape(truncate(str(error), 500))}\n\n"
+        )
+        footer = f"\n\nFull details: /error {error_id}" if error_id else ""
+        tb_string = "".join(traceback.format_tb(error.__traceback__))
+        room = MessageLimit.MAX_TEXT_LENGTH - len(header) - len(footer) - 20
+        # Escaping can grow the text, so trim until the escaped form fits
+        body = html.escape(truncate(tb_string, room))
+        while len(body) > room:
+            room -= len(body) - room
+            body = html.escape(truncate(tb_string, room))
+        return f"{header}<pre>{body}</pre>{footer}"
+
+    async def _close_window(self, bot: Bot, key: str, entry: _Window) -> None:
+        await asyncio.sleep(self.window)
+        self._windows.pop(key, None)
+        if entry.count:
+            latest = f", latest: /error {entry.last_id}" if entry.last_id else ""
+            await self._send(
+                bot,
+                f"[{key}] repeated {entry.count} more times in the last "
+                f"{int(time.monotonic() - entry.started)}s{latest}",
+            )
+
+    async def _send(self, bot: Bot, text: str) -> None:
+        if not self._limiter.has_capacity():
+            metrics.inc("error_reports_dropped_total")
+            return
+        await self._limiter.acquire()
+        try:
+            await bot.send_message(self.chat_id, text, parse_mode=ParseMode.HTML)
+        except TelegramError as e:
+            logger.warning("could not report error: {}".format(e))
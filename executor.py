@@ -0,0 +1,384 @@
+import asyncio
+import logging
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ExecutionResult:
+    """Output of a single run of the challenge tests against a submission."""
+
+    stdout: str = ""
+    stderr: str = ""
+    error: str = ""
+    duration: float = 0.0
+
+
+class ExecutorError(Exception):
+    """Raised when the execution backend could not produce a result.
+
+    ``transient`` errors (timeouts, connection failures, 5xx and 429) may
+    succeed when retried, the others will not.
+    """
+
+    def __init__(self, message: str, transient: bool = True) -> None:
+        super().__init__(message)
+        self.transient = transient
+
+
+class CircuitOpen(ExecutorError):
+    """Raised without calling the backend while it is considered down."""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"circuit open for {retry_after:.0f}s", transient=False)
+        self.retry_after = retry_after
+
+
+class Executor:
+    """Runs challenge tests against a submission and returns glot-shaped output."""
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @property
+    def retry_after(self) -> float:
+        """Seconds until the backend accepts runs again, 0 when it does now."""
+        return 0.0
+
+    async def run(self, tests: str, code: str) -> ExecutionResult:
+        raise NotImplementedError
+
+
+class GlotExecutor(Executor):
+    """Runs submissions on a glot instance through a shared keep-alive pool.
+
+    At most ``max_concurrency`` runs are in flight at once, the rest wait on a
+    semaphore instead of opening new connections.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        authorization: str,
+        max_concurrency: int = 8,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+    ) -> None:
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self._headers = {
+            "Authorization": authorization,
+            "Content-type": "application/json",
+        }
+        self._timeout = httpx.Timeout(read_timeout, connect=connect_timeout, pool=None)
+        self._limits = httpx.Limits(
+            max_connections=max_concurrency,
+            max_keepalive_connections=max_concurrency,
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers=self._headers, timeout=self._timeout, limits=self._limits
+            )
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def run(self, tests: str, code: str) -> ExecutionResult:
+        await self.start()
+        data = {
+            "files": [
+                {"name": "tests.py", "content": tests},
+                {"name": "user_code.py", "content": code},
+            ]
+        }
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                response = await self._client.post(self.url, json=data)
+                response.raise_for_status()
+                response_json = response.json()
+            except httpx.TimeoutException as e:
+                raise ExecutorError(f"glot timed out: {e!r}") from e
+            except httpx.HTTPStatusError as e:
+                status = e.response.status_code
+                raise ExecutorError(
+                    f"glot answered {status}", transient=status >= 500 or status == 429
+                ) from e
+            except (httpx.HTTPError, ValueError) as e:
+                raise ExecutorError(f"glot request failed: {e!r}") from e
+
+        return ExecutionResult(
+            stdout=response_json.get("stdout") or "",
+            stderr=response_json.get("stderr") or "",
+            error=response_json.get("error") or "",
+            duration=time.perf_counter() - started,
+        )
+
+
+# Exit status of an interpreter that found itself outside the sandbox
+SANDBOX_EXIT = 86
+
+# Where the sandbox mounts each interpreter's working directory
+SANDBOX_WORKDIR = "/work"
+
+# Executed by every pooled interpreter inside the sandbox: refuse to run as
+# root or as the bot's own user, lock the resource limits so user code cannot
+# raise them, wait for the go line on stdin, then run tests.py from the
+# working directory exactly like ``python tests.py`` would.
+_BOOTSTRAP = f"""
+import os, resource, runpy, sys
+host_uid, *limits = [int(value) for value in sys.argv[1:]]
+if {{os.getuid(), os.geteuid()}} & {{0, host_uid}}:
+    sys.stderr.write("refusing to run submissions outside the sandbox user\\n")
+    os._exit({SANDBOX_EXIT})
+names = ("RLIMIT_CPU", "RLIMIT_AS", "RLIMIT_FSIZE", "RLIMIT_NPROC", "RLIMIT_NOFILE")
+for name, value in zip(names, limits):
+    if value > 0:
+        resource.setrlimit(getattr(resource, name), (value, value))
+sys.stdin.readline()
+sys.path.insert(0, os.getcwd())
+sys.argv = ["tests.py"]
+runpy.run_path("tests.py", run_name="__main__")
+"""
+
+
+def bubblewrap(python: str = sys.executable) -> List[str]:
+    """Sandbox command prefix using bubblewrap.
+
+    The interpreter gets fresh user, PID, network, IPC and mount namespaces
+    and runs as nobody. It sees only the system libraries, its own
+    installation and its working directory at /work, all read-only, plus an
+    empty /tmp. ``{workdir}`` stands for the host path of the working
+    directory.
+    """
+    command = [
+        "bwrap",
+        "--unshare-all",
+        "--die-with-parent",
+        "--new-session",
+        "--uid",
+        "65534",
+        "--gid",
+        "65534",
+        "--ro-bind",
+        "/usr",
+        "/usr",
+        "--ro-bind-try",
+        "/lib",
+        "/lib",
+        "--ro-bind-try",
+        "/lib64",
+        "/lib64",
+        "--ro-bind-try",
+        "/bin",
+        "/bin",
+        "--proc",
+        "/proc",
+        "--dev",
+        "/dev",
+        "--tmpfs",
+        "/tmp",
+        "--ro-bind",
+        "{workdir}",
+        SANDBOX_WORKDIR,
+        "--chdir",
+        SANDBOX_WORKDIR,
+    ]
+    for path in {sys.base_prefix, os.path.dirname(python)}:
+        path = os.path.realpath(path)
+        if not path.startswith("/usr/"):
+            command += ["--ro-bind", path, path]
+    return command + ["--"]
+
+
+class LocalExecutor(Executor):
+    """Runs submissions in a pool of pre-started, sandboxed interpreters.
+
+    Every interpreter is started through ``sandbox``, a command prefix that
+    must run it as a separate unprivileged user without access to the host's
+    files or network, bubblewrap by default. The bootstrap exits when it finds
+    itself running as root or as the bot's own user, so a sandbox that does
+    not switch users fails closed. Resource limits cap CPU time, memory, file
+    size, open files and processes; the process limit counts per sandbox user,
+    so it is shared by the whole pool.
+
+    Each interpreter owns a temporary working directory that a run fills with
+    ``tests.py`` and ``user_code.py``. Interpreters are discarded after one
+    run, together with their directory, and replaced in the background. The
+    pool size caps concurrency.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 4,
+        cpu_time: int = 10,
+        memory: int = 256 * 1024 * 1024,
+        file_size: int = 1024 * 1024,
+        processes: int = 64,
+        open_files: int = 64,
+        wall_time: float = 15.0,
+        max_output: int = 64 * 1024,
+        python: str = sys.executable,
+        sandbox: Optional[Sequence[str]] = None,
+    ) -> None:
+        self.pool_size = pool_size
+        self.cpu_time = cpu_time
+        self.memory = memory
+        self.file_size = file_size
+        self.processes = processes
+        self.open_files = open_files
+        self.wall_time = wall_time
+        self.max_output = max_output
+        self.python = python
+        self.sandbox = list(sandbox) if sandbox is not None else bubblewrap(python)
+        self._idle: Optional[asyncio.Queue] = None
+        self._spawning = set()
+        self._workdirs: Dict[int, str] = {}
+
+    async def start(self) -> None:
+        if self._idle is not None:
+            return
+        if not self.sandbox or shutil.which(self.sandbox[0]) is None:
+            raise ExecutorError(
+                "LocalExecutor needs a sandbox, {} not found".format(
+                    self.sandbox[0] if self.sandbox else "none configured,"
+                ),
+                transient=False,
+            )
+        self._idle = asyncio.Queue()
+        for _ in range(self.pool_size):
+            await self._idle.put(await self._spawn())
+
+    async def close(self) -> None:
+        if self._idle is None:
+            return
+        for task in list(self._spawning):
+            task.cancel()
+        await asyncio.gather(*self._spawning, return_exceptions=True)
+        while not self._idle.empty():
+            await self._kill(self._idle.get_nowait())
+        self._idle = None
+
+    async def _spawn(self) -> asyncio.subprocess.Process:
+        workdir = tempfile.mkdtemp(prefix="judge-")
+        # Readable by the sandbox user, writable only by the bot
+        os.chmod(workdir, 0o755)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *(part.replace("{workdir}", workdir) for part in self.sandbox),
+                self.python,
+                "-I",
+                "-c",
+                _BOOTSTRAP,
+                str(os.getuid()),
+                str(self.cpu_time),
+                str(self.memory),
+                str(self.file_size),
+                str(self.processes),
+                str(self.open_files),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=workdir,
+                env={"PYTHONDONTWRITEBYTECODE": "1", "PYTHONIOENCODING": "utf-8"},
+                start_new_session=True,
+            )
+        except BaseException:
+            shutil.rmtree(workdir, ignore_errors=True)
+            raise
+        self._workdirs[process.pid] = workdir
+        return process
+
+    async def _replenish(self) -> None:
+        await self._idle.put(await self._spawn())
+
+    def _schedule_replenish(self) -> None:
+        task = asyncio.create_task(self._replenish())
+        self._spawning.add(task)
+        task.add_done_callback(self._spawning.discard)
+
+    async def _kill(self, process: asyncio.subprocess.Process) -> None:
+        # Every interpreter leads its own session, so this also takes down
+        # anything the submission forked.
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await process.wait()
+        workdir = self._workdirs.pop(process.pid, None)
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    async def _read_capped(self, stream: asyncio.StreamReader) -> str:
+        data = bytearray()
+        while chunk := await stream.read(65536):
+            if len(data) < self.max_output:
+                data += chunk[: self.max_output - len(data)]
+        return data.decode("utf-8", errors="replace")
+
+    async def _acquire(self) -> asyncio.subprocess.Process:
+        while True:
+            process = await self._idle.get()
+            self._schedule_replenish()
+            if process.returncode is None:
+                return process
+            await self._kill(process)
+
+    async def run(self, tests: str, code: str) -> ExecutionResult:
+        await self.start()
+        process = await self._acquire()
+        workdir = self._workdirs[process.pid]
+        try:
+            for name, content in (("tests.py", tests), ("user_code.py", code)):
+                with open(os.path.join(workdir, name), "w", encoding="utf-8") as f:
+                    f.write(content)
+
+            started = time.perf_counter()
+            process.stdin.write(b"\n")
+            process.stdin.close()
+            output = asyncio.gather(
+                self._read_capped(process.stdout),
+                self._read_capped(process.stderr),
+                process.wait(),
+            )
+            try:
+                stdout, stderr, returncode = await asyncio.wait_for(
+                    output, self.wall_time
+                )
+            except asyncio.TimeoutError:
+                return ExecutionResult(
+                    error=f"Timed out after {self.wall_time}s",
+                    stderr=f"Vaqt chegarasi ({self.wall_time}s) oshib ketdi\n",
+                    duration=time.perf_counter() - started,
+                )
+        finally:
+            await self._kill(process)
+
+        if returncode == SANDBOX_EXIT:
+            logger.error("sandbox check failed: {}".format(stderr.strip()))
+            raise ExecutorError("submission ran outside the sandbox", transient=False)
+        return ExecutionResult(
+            stdout=stdout,
+            stderr=stderr,
+            error=f"Exit code: {returncode}" if returncode else "",
+            duration=time.perf_counter() - started,
+        )
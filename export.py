@@ -0,0 +1,108 @@
+import asyncio
+import csv
+import gzip
+import json
+import os
+import sqlite3
+from typing import IO, Iterator, List, Sequence, Tuple
+
+from database import inflate
+
+FORMATS = ("csv", "jsonl")
+
+# Solutions are stored compressed, the export carries them as text
+QUERIES = {
+    "challenges": """SELECT id, description, solution_photo_id, solution_text, tests
+                     FROM challenges ORDER BY id""",
+    "solvers": """SELECT solvers.id, challenge_id, chat_id, user, result,
+                         code_length, timings,
+                         COALESCE(solution, inflate(blobs.data)) AS solution
+                  FROM solvers LEFT JOIN blobs ON blobs.hash = solution_hash
+                  ORDER BY solvers.id""",
+    "users": """SELECT chat_id, username, full_name, points
+                FROM users ORDER BY chat_id""",
+}
+
+
+def export_filename(table: str, fmt: str, compress: bool) -> str:
+    return f"{table}.{fmt}" + (".gz" if compress else "")
+
+
+def _batches(
+    conn: sqlite3.Connection, table: str, batch_size: int
+) -> Tuple[List[str], Iterator[Sequence]]:
+    cursor = conn.execute(QUERIES[table])
+    columns = [column[0] for column in cursor.description]
+
+    def rows() -> Iterator[Sequence]:
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                return
+            yield from batch
+
+    return columns, rows()
+
+
+def _write(out: IO[str], fmt: str, columns: List[str], rows: Iterator[Sequence]) -> int:
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            out.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+            out.write("\n")
+            count += 1
+    return count
+
+
+def export_table(
+    db_path: str,
+    table: str,
+    path: str,
+    fmt: str = "csv",
+    compress: bool = False,
+    batch_size: int = 500,
+) -> int:
+    """Streams one table into a CSV or JSON Lines file, returns the row count.
+
+    Rows are fetched ``batch_size`` at a time from a read-only connection of
+    its own, so memory use does not grow with the table and the bot's readers
+    are not held up. The export sees one consistent snapshot of the database.
+    """
+    if table not in QUERIES:
+        raise ValueError(f"cannot export {table}, choose from {', '.join(QUERIES)}")
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt}, choose from {', '.join(FORMATS)}")
+
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    conn.create_function("inflate", 1, inflate, deterministic=True)
+    opener = gzip.open if compress else open
+    try:
+        with opener(path, "wt", encoding="utf-8", newline="") as out:
+            columns, rows = _batches(conn, table, batch_size)
+            return _write(out, fmt, columns, rows)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    finally:
+        conn.close()
+
+
+async def export(
+    db_path: str,
+    table: str,
+    path: str,
+    fmt: str = "csv",
+    compress: bool = False,
+    batch_size: int = 500,
+) -> int:
+    """Runs export_table on a worker thread."""
+    return await asyncio.to_thread(
+        export_table, db_path, table, path, fmt, compress, batch_size
+    )
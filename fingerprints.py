@@ -0,0 +1,166 @@
+import ast
+import builtins
+import hashlib
+import io
+import keyword
+import tokenize
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional
+
+# A copy of at least WINDOW + K - 1 tokens always shares a k-gram
+K = 5
+WINDOW = 4
+
+_BUILTINS = frozenset(dir(builtins))
+
+_SKIPPED_TOKENS = {
+    tokenize.COMMENT,
+    tokenize.NL,
+    tokenize.NEWLINE,
+    tokenize.INDENT,
+    tokenize.DEDENT,
+    tokenize.ENCODING,
+    tokenize.ENDMARKER,
+}
+
+
+@dataclass(frozen=True)
+class Fingerprint:
+    """What duplicate detection knows about a solution.
+
+    ``ast_hash`` matches solutions that differ only in names, constants,
+    comments and formatting, ``kgrams`` are the winnowed token k-gram hashes
+    that near copies share.
+    """
+
+    ast_hash: Optional[str]
+    kgrams: FrozenSet[int]
+
+
+class _Canonicalizer(ast.NodeTransformer):
+    """Renames identifiers in order of appearance and blanks constants."""
+
+    def __init__(self) -> None:
+        self.names: Dict[str, str] = {}
+
+    def _rename(self, name: Optional[str]) -> Optional[str]:
+        if name is None or name in _BUILTINS:
+            return name
+        return self.names.setdefault(name, f"_{len(self.names)}")
+
+    def _strip_docstring(self, node: ast.AST) -> None:
+        body = node.body
+        if (
+            body
+            and isinstance(body[0], ast.Expr)
+            and isinstance(body[0].value, ast.Constant)
+            and isinstance(body[0].value.value, str)
+        ):
+            node.body = body[1:] or [ast.Pass()]
+
+    def visit_Module(self, node: ast.Module) -> ast.AST:
+        self._strip_docstring(node)
+        return self.generic_visit(node)
+
+    def _visit_definition(self, node: ast.AST) -> ast.AST:
+        node.name = self._rename(node.name)
+        self._strip_docstring(node)
+        return self.generic_visit(node)
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = _visit_definition
+
+    def visit_Name(self, node: ast.Name) -> ast.AST:
+        node.id = self._rename(node.id)
+        return node
+
+    def visit_arg(self, node: ast.arg) -> ast.AST:
+        node.arg = self._rename(node.arg)
+        return self.generic_visit(node)
+
+    def visit_keyword(self, node: ast.keyword) -> ast.AST:
+        # Keywords of the solution's own functions were renamed with them
+        if node.arg in self.names:
+            node.arg = self.names[node.arg]
+        return self.generic_visit(node)
+
+    def visit_ExceptHandler(self, node: ast.ExceptHandler) -> ast.AST:
+        node.name = self._rename(node.name)
+        return self.generic_visit(node)
+
+    def visit_alias(self, node: ast.alias) -> ast.AST:
+        node.asname = self._rename(node.asname)
+        return node
+
+    def visit_Global(self, node: ast.Global) -> ast.AST:
+        node.names = [self._rename(name) for name in node.names]
+        return node
+
+    visit_Nonlocal = visit_Global
+
+    def visit_Constant(self, node: ast.Constant) -> ast.AST:
+        return ast.Constant(value=type(node.value).__name__)
+
+
+def ast_hash(tree: ast.Module) -> str:
+    """Hash of a parsed solution with names and constants canonicalized.
+
+    The tree is modified in place.
+    """
+    canonical = _Canonicalizer().visit(tree)
+    return hashlib.sha256(ast.dump(canonical).encode("utf-8")).hexdigest()
+
+
+def _tokens(code: str) -> List[str]:
+    """Significant tokens with identifiers and literals reduced to their kind."""
+    tokens = []
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type in _SKIPPED_TOKENS:
+                continue
+            if token.type == tokenize.NAME:
+                is_kept = keyword.iskeyword(token.string) or token.string in _BUILTINS
+                tokens.append(token.string if is_kept else "V")
+            elif token.type == tokenize.NUMBER:
+                tokens.append("N")
+            elif token.type == tokenize.STRING:
+                tokens.append("S")
+            else:
+                tokens.append(token.string)
+    except (tokenize.TokenError, SyntaxError):
+        pass
+    return tokens
+
+
+def _hash(text: str) -> int:
+    # Signed 64 bits to fit an SQLite INTEGER
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def winnow(code: str, k: int = K, window: int = WINDOW) -> FrozenSet[int]:
+    """Winnowed k-gram hashes: the smallest hash of every window of them."""
+    tokens = _tokens(code)
+    if not tokens:
+        return frozenset()
+    hashes = [
+        _hash(" ".join(tokens[i : i + k])) for i in range(max(len(tokens) - k + 1, 1))
+    ]
+    if len(hashes) <= window:
+        return frozenset({min(hashes)})
+    return frozenset(
+        min(hashes[start : start + window]) for start in range(len(hashes) - window + 1)
+    )
+
+
+def fingerprint(code: str, tree: Optional[ast.Module] = None) -> Fingerprint:
+    """Fingerprints a solution, reusing ``tree`` when it is already parsed."""
+    if tree is None:
+        try:
+            tree = ast.parse(code)
+        except (SyntaxError, ValueError, RecursionError, MemoryError):
+            return Fingerprint(None, winnow(code))
+    try:
+        digest = ast_hash(tree)
+    except RecursionError:
+        digest = None
+    return Fingerprint(digest, winnow(code))
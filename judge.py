@@ -0,0 +1,223 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Tuple, Union
+
+from batch import build_batch, parse_batch
+from executor import CircuitOpen, ExecutionResult, Executor, ExecutorError
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when a submission cannot be accepted right now."""
+
+
+class _Job:
+    __slots__ = ("chat_id", "tests", "code", "batch", "future")
+
+    def __init__(self, chat_id: int, tests: str, code: str, batch: bool) -> None:
+        self.chat_id = chat_id
+        self.tests = tests
+        self.code = code
+        self.batch = batch
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class Judge:
+    """Bounded submission queue drained by a fixed pool of workers.
+
+    Every chat has its own FIFO and workers take one job per chat in turn, so a
+    user resubmitting in a loop only delays their own submissions. The number
+    of workers is the hard ceiling on concurrent executor calls.
+
+    With ``batch_size`` above 1 a worker waits up to ``batch_window`` seconds
+    for more jobs with the same tests at the head of other chats' queues and
+    judges up to ``batch_size`` of them in a single executor call, each
+    solution in its own process limited to ``batch_timeout`` seconds.
+    """
+
+    def __init__(
+        self,
+        executor: Executor,
+        workers: int = 4,
+        max_pending: int = 500,
+        max_pending_per_chat: int = 3,
+        batch_size: int = 1,
+        batch_window: float = 0.05,
+        batch_timeout: float = 10.0,
+    ) -> None:
+        self.executor = executor
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_pending_per_chat = max_pending_per_chat
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.batch_timeout = batch_timeout
+        self._queues: "OrderedDict[int, Deque[_Job]]" = OrderedDict()
+        self._pending = 0
+        self._busy = 0
+        self._available: Optional[asyncio.Semaphore] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def busy(self) -> int:
+        return self._busy
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._available = asyncio.Semaphore(0)
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"judge-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._available = None
+        for queue in self._queues.values():
+            for job in queue:
+                if not job.future.done():
+                    job.future.set_exception(ExecutorError("judge stopped"))
+        self._queues.clear()
+        self._pending = 0
+
+    def submit(
+        self, chat_id: int, tests: str, code: str, batch: bool = True
+    ) -> Tuple[int, "asyncio.Future[ExecutionResult]"]:
+        """Queues a run and returns its wait position and a future for the result.
+
+        The position is 0 when an idle worker will pick the job up right away,
+        otherwise the estimated 1-based place in the waiting line. Jobs with
+        ``batch`` unset always get an executor call of their own.
+        """
+        if self._available is None:
+            raise ExecutorError("judge is not running")
+        if self.executor.retry_after:
+            raise CircuitOpen(self.executor.retry_after)
+        queue = self._queues.get(chat_id)
+        if self._pending >= self.max_pending or (
+            queue is not None and len(queue) >= self.max_pending_per_chat
+        ):
+            raise QueueFull
+
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+        job = _Job(chat_id, tests, code, batch)
+        queue.append(job)
+        self._pending += 1
+
+        # Round-robin serves at most len(queue) jobs from every other chat
+        # before reaching this one.
+        rank = len(queue)
+        others = sum(
+            min(len(other), rank)
+            for other_id, other in self._queues.items()
+            if other_id != chat_id
+        )
+        ahead = rank - 1 + others
+        idle = self.workers - self._busy
+        position = 0 if ahead < idle else ahead - idle + 1
+
+        self._available.release()
+        return position, job.future
+
+    def _next_job(self) -> _Job:
+        chat_id, queue = next(iter(self._queues.items()))
+        job = queue.popleft()
+        if queue:
+            self._queues.move_to_end(chat_id)
+        else:
+            del self._queues[chat_id]
+        self._pending -= 1
+        return job
+
+    def _take_batch(self, jobs: List[_Job]) -> None:
+        """Moves queue heads with the same tests as ``jobs[0]`` into ``jobs``."""
+        tests = jobs[0].tests
+        for chat_id, queue in list(self._queues.items()):
+            if len(jobs) >= self.batch_size:
+                break
+            head = queue[0]
+            if not head.batch or head.tests != tests:
+                continue
+            queue.popleft()
+            if not queue:
+                del self._queues[chat_id]
+            self._pending -= 1
+            if not head.future.done():
+                jobs.append(head)
+
+    async def _run(
+        self, jobs: List[_Job]
+    ) -> List[Union[ExecutionResult, BaseException]]:
+        if len(jobs) == 1:
+            with metrics.timer("executor_run_seconds"):
+                return [await self.executor.run(jobs[0].tests, jobs[0].code)]
+
+        metrics.inc("judge_batches_total")
+        metrics.inc("judge_batched_jobs_total", len(jobs))
+        driver, payload = build_batch(
+            jobs[0].tests, [job.code for job in jobs], self.batch_timeout
+        )
+        with metrics.timer("executor_run_seconds", batch=True):
+            execution = await self.executor.run(driver, payload)
+        results = parse_batch(execution.stdout, len(jobs))
+        if results is not None:
+            return results
+
+        logger.warning(
+            "batch of {} gave no report, judging one by one".format(len(jobs))
+        )
+        results = []
+        for job in jobs:
+            try:
+                with metrics.timer("executor_run_seconds"):
+                    results.append(await self.executor.run(job.tests, job.code))
+            except ExecutorError as e:
+                results.append(e)
+        return results
+
+    async def _worker(self) -> None:
+        while True:
+            await self._available.acquire()
+            if not self._queues:
+                # The job this permit was released for went into a batch.
+                continue
+            jobs = [self._next_job()]
+            if jobs[0].future.done():
+                continue
+            self._busy += 1
+            try:
+                if jobs[0].batch and self.batch_size > 1:
+                    self._take_batch(jobs)
+                    if len(jobs) < self.batch_size and self.batch_window > 0:
+                        await asyncio.sleep(self.batch_window)
+                        self._take_batch(jobs)
+                results = await self._run(jobs)
+            except asyncio.CancelledError:
+                for job in jobs:
+                    if not job.future.done():
+                        job.future.set_exception(ExecutorError("judge stopped"))
+                raise
+            except Exception as e:
+                results = [e] * len(jobs)
+            finally:
+                self._busy -= 1
+
+            for job, result in zip(jobs, results):
+                if isinstance(result, BaseException):
+                    metrics.inc("executor_errors_total", error=type(result).__name__)
+                    if not job.future.done():
+                        job.future.set_exception(result)
+                elif not job.future.done():
+                    job.future.set_result(result)
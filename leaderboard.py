@@ -0,0 +1,211 @@
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Iterable, List, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from database import Database, Solve
+
+logger = logging.getLogger(__name__)
+
+POINTS = "top"
+SPEED = "speed"
+LENGTH = "length"
+TODAY = "today"
+
+CALLBACK_PREFIX = "lb|"
+
+_COLUMNS = {SPEED: "result", LENGTH: "code_length"}
+_TITLES = {SPEED: "Tezlik:", LENGTH: "Qisqalik:"}
+
+Rendered = Tuple[str, Optional[InlineKeyboardMarkup]]
+
+
+@dataclass(frozen=True)
+class Cursor:
+    """One leaderboard page, small enough to travel as callback data.
+
+    ``key`` is the (value, id) pair of the row next to the page, ``forward``
+    tells whether the page lies after it or before it, and ``start`` is the
+    place of the page's first row.
+    """
+
+    board: str
+    challenge_id: int = 0
+    forward: bool = True
+    start: int = 1
+    key: Optional[Tuple[float, int]] = None
+
+    def pack(self) -> str:
+        key = f"{self.key[0]!r}|{self.key[1]}" if self.key is not None else "|"
+        direction = "n" if self.forward else "p"
+        return (
+            f"{CALLBACK_PREFIX}{self.board}|{self.challenge_id}|{direction}|"
+            f"{self.start}|{key}"
+        )
+
+    @classmethod
+    def unpack(cls, data: str) -> "Cursor":
+        """Parses callback data made by pack, raises ValueError otherwise."""
+        if not data.startswith(CALLBACK_PREFIX):
+            raise ValueError(f"not a leaderboard cursor: {data!r}")
+        board, challenge_id, direction, start, value, row_id = data[
+            len(CALLBACK_PREFIX) :
+        ].split("|")
+        if board not in (POINTS, SPEED, LENGTH, TODAY) or direction not in "np":
+            raise ValueError(f"malformed leaderboard cursor: {data!r}")
+        key = (float(value), int(row_id)) if value else None
+        return cls(board, int(challenge_id), direction == "n", int(start), key)
+
+
+class Leaderboards:
+    """Renders keyset-paginated leaderboards and caches the rendered pages.
+
+    Pages are cached per cursor until ``invalidate`` is called for their
+    challenge, which happens whenever solves for it are stored; the overall
+    points board is dropped on every solve.
+    """
+
+    def __init__(self, db: Database, page_size: int = 10, max_pages: int = 512):
+        self.db = db
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._pages: "OrderedDict[Cursor, Rendered]" = OrderedDict()
+
+    def invalidate(self, challenge_id: int) -> None:
+        for cursor in [
+            cursor
+            for cursor in self._pages
+            if cursor.board == POINTS or cursor.challenge_id == challenge_id
+        ]:
+            del self._pages[cursor]
+
+    def invalidate_solves(self, solves: Iterable[Solve]) -> None:
+        for challenge_id in {solve.challenge_id for solve in solves}:
+            self.invalidate(challenge_id)
+
+    async def page(self, cursor: Cursor) -> Rendered:
+        rendered = self._pages.get(cursor)
+        if rendered is not None:
+            self._pages.move_to_end(cursor)
+            return rendered
+
+        if cursor.board == TODAY:
+            rendered = await self._render_today(cursor.challenge_id)
+        else:
+            rendered = await self._render(cursor)
+        self._pages[cursor] = rendered
+        if len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+        return rendered
+
+    async def _fetch(self, cursor: Cursor) -> Tuple[List, Cursor, bool, bool]:
+        """Rows of a page, its corrected cursor and whether pages surround it."""
+        limit = self.page_size + 1
+        after = cursor.key if cursor.forward else None
+        before = None if cursor.forward else cursor.key
+        if cursor.board == POINTS:
+            rows = await self.db.users_page(after, before, limit)
+        else:
+            rows = await self.db.solvers_page(
+                cursor.challenge_id, _COLUMNS[cursor.board], after, before, limit
+            )
+
+        if cursor.forward:
+            has_next = len(rows) > self.page_size
+            return rows[: self.page_size], cursor, cursor.start > 1, has_next
+        has_prev = len(rows) > self.page_size
+        if not has_prev:
+            cursor = replace(cursor, start=1)
+        return rows[-self.page_size :], cursor, has_prev, True
+
+    def _key(self, board: str, row) -> Tuple[float, int]:
+        if board == POINTS:
+            return row["points"], row["chat_id"]
+        return row[_COLUMNS[board]], row["id"]
+
+    @staticmethod
+    def _line(board: str, place: int, row) -> str:
+        if board == POINTS:
+            username = f"@{row['username']}" if row["username"] else row["full_name"]
+            return f"{place}. {username} - {row['points']} ball"
+        if board == SPEED:
+            return f"{place}. {row['user']} - {row['result']:.6f}s"
+        return f"{place}. {row['user']} - {row['code_length']} token"
+
+    def _lines(self, board: str, rows: List, start: int) -> List[str]:
+        lines = [_TITLES[board]] if board in _TITLES else []
+        lines.extend(
+            self._line(board, place, row) for place, row in enumerate(rows, start)
+        )
+        return lines
+
+    def _next(self, cursor: Cursor, rows: List) -> Cursor:
+        return replace(
+            cursor,
+            forward=True,
+            start=cursor.start + len(rows),
+            key=self._key(cursor.board, rows[-1]),
+        )
+
+    async def _render(self, cursor: Cursor) -> Rendered:
+        rows, cursor, has_prev, has_next = await self._fetch(cursor)
+        if not rows:
+            return "hali aniqlanmagan", None
+
+        buttons = []
+        if has_prev:
+            previous = replace(
+                cursor,
+                forward=False,
+                start=max(cursor.start - self.page_size, 1),
+                key=self._key(cursor.board, rows[0]),
+            )
+            buttons.append(InlineKeyboardButton("⬅️", callback_data=previous.pack()))
+        if has_next:
+            buttons.append(
+                InlineKeyboardButton(
+                    "➡️", callback_data=self._next(cursor, rows).pack()
+                )
+            )
+        text = "\n".join(self._lines(cursor.board, rows, cursor.start))
+        return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+    async def _render_today(self, challenge_id: int) -> Rendered:
+        """First page of both challenge boards in one message."""
+        sections = []
+        buttons = []
+        for board in (SPEED, LENGTH):
+            rows, cursor, _, has_next = await self._fetch(Cursor(board, challenge_id))
+            if not rows:
+                continue
+            sections.append("\n".join(self._lines(board, rows, 1)))
+            if has_next:
+                buttons.append(
+                    InlineKeyboardButton(
+                        f"{_TITLES[board][:-1]} ➡️",
+                        callback_data=self._next(cursor, rows).pack(),
+                    )
+                )
+        if not sections:
+            return "hali aniqlanmagan", None
+        text = "\n\n---\n\n".join(sections)
+        return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+    async def rank_line(self, chat_id: int, challenge_id: int = 0) -> Optional[str]:
+        """The caller's own place, or None when they are not on the board."""
+        if not challenge_id:
+            ranked = await self.db.user_rank(chat_id)
+            if ranked is None:
+                return None
+            return f"Sizning o'rningiz: {ranked[0]} ({ranked[1]['points']} ball)"
+
+        speed = await self.db.solver_rank(challenge_id, chat_id, "result")
+        if speed is None:
+            return None
+        length = await self.db.solver_rank(challenge_id, chat_id, "code_length")
+        return (
+            f"Sizning o'rningiz: tezlik bo'yicha {speed[0]}, "
+            f"qisqalik bo'yicha {length[0]}"
+        )
@@ -0,0 +1,122 @@
+import gzip
+import json
+import logging
+import os
+import queue
+import random
+import shutil
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
+from typing import Optional
+
+SOURCE_LOGGER = "submissions"
+
+# Attributes every LogRecord has, anything else was passed through ``extra``
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the ``extra`` fields as top-level keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(
+            (key, value)
+            for key, value in vars(record).items()
+            if key not in _RESERVED and not key.startswith("_")
+        )
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """Lets through roughly ``rate`` of the records."""
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return self.rate >= 1 or random.random() < self.rate
+
+
+def _gzip_namer(name: str) -> str:
+    return name + ".gz"
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def _file_handler(
+    filename: str, max_bytes: int, backup_count: int, when: Optional[str]
+) -> logging.Handler:
+    if when:
+        handler = TimedRotatingFileHandler(
+            filename, when=when, backupCount=backup_count, encoding="utf-8"
+        )
+    else:
+        handler = RotatingFileHandler(
+            filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+    handler.namer = _gzip_namer
+    handler.rotator = _gzip_rotator
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def setup_logging(
+    filename: str,
+    level: int = logging.INFO,
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 10,
+    when: Optional[str] = None,
+    source_filename: Optional[str] = None,
+    source_sample_rate: float = 0.0,
+) -> QueueListener:
+    """Routes all logging through a queue drained by a background thread.
+
+    Handlers on the event loop only enqueue records; formatting, writing and
+    compressing rotated files happen on the listener thread. Submitted source
+    code goes to the ``submissions`` logger, which is written to its own
+    file for a ``source_sample_rate`` share of records and dropped otherwise.
+    The returned listener is already started and must be stopped on exit.
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handlers = [_file_handler(filename, max_bytes, backup_count, when)]
+
+    source_logger = logging.getLogger(SOURCE_LOGGER)
+    source_logger.propagate = False
+    if source_filename and source_sample_rate > 0:
+        source_handler = _file_handler(source_filename, max_bytes, backup_count, when)
+        source_handler.addFilter(lambda record: record.name == SOURCE_LOGGER)
+        handlers[0].addFilter(lambda record: record.name != SOURCE_LOGGER)
+        handlers.append(source_handler)
+
+        queue_handler = QueueHandler(log_queue)
+        queue_handler.addFilter(SampleFilter(source_sample_rate))
+        source_logger.addHandler(queue_handler)
+    else:
+        source_logger.disabled = True
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(QueueHandler(log_queue))
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
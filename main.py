@@ -1,106 +1,171 @@
-import html
+import argparse
+import asyncio
+import functools
 import json
 import logging
+import os
 import re
-import sqlite3
-import traceback
+import sys
+import tempfile
+import time
 from os import environ
-from typing import Optional, Tuple
-from urllib.request import urlopen
+from typing import List, Optional, Set, Tuple
 
-import requests
-from telegram import Update, File, ChatMemberUpdated, ChatMember, Chat
+from telegram import Bot, Update, ChatMemberUpdated, ChatMember, Chat
 from telegram.constants import ParseMode
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
-    PicklePersistence,
     ContextTypes,
     CommandHandler,
     MessageHandler,
     filters,
     ConversationHandler,
     ChatMemberHandler,
+    CallbackQueryHandler,
 )
 from dotenv import load_dotenv
 
+from benchmark import build_harness, parse_report
+from broadcast import Broadcaster, photo_message, text_message
+from challenges import Challenge, ChallengeCache
+from database import Database, Solve, SolveBuffer
+from documents import DocumentDecodeError, DocumentDownloader, DocumentTooLarge
+from errors import ErrorReporter
+from export import FORMATS, QUERIES, export, export_filename, export_table
+from executor import (
+    CircuitOpen,
+    ExecutionResult,
+    Executor,
+    ExecutorError,
+    GlotExecutor,
+    LocalExecutor,
+)
+from judge import Judge, QueueFull
+from leaderboard import POINTS, TODAY, Cursor, Leaderboards
+from log_pipeline import SOURCE_LOGGER, setup_logging
+from metrics import MetricsServer, instrument_handlers, metrics
+from persistence import SQLitePersistence
+from preflight import PreflightError, preflight
+from rejudge import Rejudger
+from resilience import CircuitBreaker, ResilientExecutor
+from result_cache import ResultCache
+from update_processor import PerChatUpdateProcessor
+
 load_dotenv()
 
 """Constants"""
 
-logging.basicConfig(
-    filename="syccbot.log",
-    format="[%(asctime)s %(levelname)s] %(message)s",
-    level=logging.INFO,
-)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
+source_logger = logging.getLogger(SOURCE_LOGGER)
 
 # Database setup
 DB_FILE = "code_checker.db"
-
-
-def get_db_connection():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-
-def setup_database():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    # Create users table
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            chat_id INTEGER PRIMARY KEY,
-            username TEXT,
-            full_name TEXT,
-            solved_challenges TEXT,
-            points INTEGER
-        )
-    """
-    )
-    # Create challenges table
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS challenges (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            description TEXT,
-            solution_photo_id TEXT,
-            solution_text TEXT,
-            tests TEXT
-        )
-    """
-    )
-    # Create solvers table
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS solvers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            challenge_id INTEGER,
-            user TEXT,
-            result REAL,
-            solution TEXT,
-            code_length INTEGER,
-            UNIQUE(challenge_id, user)
-        )
-    """
-    )
-    conn.commit()
-    conn.close()
-
+db = Database(
+    DB_FILE,
+    readers=int(environ.get("DB_READERS", 2)),
+    cache_size_kib=int(environ.get("DB_CACHE_SIZE_KIB", 16 * 1024)),
+    mmap_size=int(environ.get("DB_MMAP_SIZE", 64 * 1024 * 1024)),
+)
+challenges = ChallengeCache(
+    db, max_entries=int(environ.get("CHALLENGE_CACHE_SIZE", 32))
+)
+leaderboards = Leaderboards(db, page_size=int(environ.get("LEADERBOARD_PAGE_SIZE", 10)))
+solve_buffer = SolveBuffer(
+    db,
+    max_records=int(environ.get("SOLVE_BATCH_SIZE", 50)),
+    max_delay=float(environ.get("SOLVE_FLUSH_MS", 200)) / 1000,
+    on_commit=leaderboards.invalidate_solves,
+)
 
 DEVELOPER_CHAT_ID = environ["DEVELOPER_CHAT_ID"]
 # CHANNEL_ID = environ['DEV_CHANNEL_ID']
 CHANNEL_ID = environ["PROD_CHANNEL_ID"]
-GLOT_URL = environ["GLOT_URL"]
+EXECUTOR_BACKEND = environ.get("EXECUTOR_BACKEND", "glot")
 DIVIDER = "----------------------------------------------------------------------"
 
-headers = {
-    "Authorization": environ["GLOT_AUTHORIZATION"],
-    "Content-type": "application/json",
-}
+backend: Executor
+if EXECUTOR_BACKEND == "local":
+    backend = LocalExecutor(
+        pool_size=int(environ.get("LOCAL_POOL_SIZE", 4)),
+        cpu_time=int(environ.get("LOCAL_CPU_TIME", 10)),
+        memory=int(environ.get("LOCAL_MEMORY_BYTES", 256 * 1024 * 1024)),
+        file_size=int(environ.get("LOCAL_FILE_SIZE_BYTES", 1024 * 1024)),
+        wall_time=float(environ.get("LOCAL_WALL_TIME", 15)),
+    )
+else:
+    backend = GlotExecutor(
+        environ["GLOT_URL"],
+        environ["GLOT_AUTHORIZATION"],
+        max_concurrency=int(environ.get("GLOT_MAX_CONCURRENCY", 8)),
+        connect_timeout=float(environ.get("GLOT_CONNECT_TIMEOUT", 5)),
+        read_timeout=float(environ.get("GLOT_READ_TIMEOUT", 30)),
+    )
+executor = ResilientExecutor(
+    backend,
+    CircuitBreaker(
+        failure_threshold=float(environ.get("CIRCUIT_FAILURE_THRESHOLD", 0.5)),
+        window=int(environ.get("CIRCUIT_WINDOW", 20)),
+        min_calls=int(environ.get("CIRCUIT_MIN_CALLS", 5)),
+        reset_timeout=float(environ.get("CIRCUIT_RESET_TIMEOUT", 30)),
+    ),
+    retries=int(environ.get("EXECUTOR_RETRIES", 2)),
+    base_delay=float(environ.get("EXECUTOR_RETRY_DELAY", 0.5)),
+    max_delay=float(environ.get("EXECUTOR_RETRY_MAX_DELAY", 5)),
+)
+judge = Judge(
+    executor,
+    workers=int(environ.get("JUDGE_WORKERS", 4)),
+    max_pending=int(environ.get("JUDGE_MAX_PENDING", 500)),
+    max_pending_per_chat=int(environ.get("JUDGE_MAX_PENDING_PER_CHAT", 3)),
+    batch_size=int(environ.get("JUDGE_BATCH_SIZE", 1)),
+    batch_window=float(environ.get("JUDGE_BATCH_WINDOW_MS", 50)) / 1000,
+    batch_timeout=float(environ.get("JUDGE_BATCH_TIMEOUT", 10)),
+)
+result_cache = ResultCache(
+    db,
+    max_entries=int(environ.get("RESULT_CACHE_SIZE", 1024)),
+    ttl=float(environ.get("RESULT_CACHE_TTL", 86400)),
+)
+downloader = DocumentDownloader(
+    max_bytes=int(environ.get("MAX_CODE_BYTES", 64 * 1024)),
+    timeout=float(environ.get("DOWNLOAD_TIMEOUT", 30)),
+)
+MAX_TESTS_BYTES = int(environ.get("MAX_TESTS_BYTES", 1024 * 1024))
+METRICS_PORT = int(environ.get("METRICS_PORT", 9108))
+metrics_server = MetricsServer(port=METRICS_PORT)
+metrics.register_gauge("judge_in_flight", lambda: judge.busy)
+metrics.register_gauge("judge_pending", lambda: judge.pending)
+metrics.register_gauge("executor_circuit_open", lambda: int(bool(executor.retry_after)))
+PREFLIGHT_MAX_NODES = int(environ.get("PREFLIGHT_MAX_NODES", 5000))
+PREFLIGHT_MAX_DEPTH = int(environ.get("PREFLIGHT_MAX_DEPTH", 100))
+BENCHMARK_REPEAT = int(environ.get("BENCHMARK_REPEAT", 5))
+BENCHMARK_WARMUP = int(environ.get("BENCHMARK_WARMUP", 1))
+rejudger = Rejudger(
+    db,
+    executor,
+    result_cache,
+    concurrency=int(environ.get("REJUDGE_CONCURRENCY", 2)),
+    benchmark_repeat=BENCHMARK_REPEAT,
+    benchmark_warmup=BENCHMARK_WARMUP,
+    on_change=leaderboards.invalidate,
+)
+
+broadcaster = Broadcaster(
+    db,
+    global_rate=float(environ.get("BROADCAST_RATE", 25)),
+    group_rate=float(environ.get("BROADCAST_GROUP_RATE", 20)),
+    concurrency=int(environ.get("BROADCAST_CONCURRENCY", 8)),
+)
+
+error_reporter = ErrorReporter(
+    db,
+    DEVELOPER_CHAT_ID,
+    window=float(environ.get("ERROR_REPORT_WINDOW", 300)),
+    max_messages=int(environ.get("ERROR_REPORT_RATE", 20)),
+)
 
 CHALLENGE_DESCRIPTION = 11
 CHALLENGE_SOLUTION = 12
@@ -139,28 +204,100 @@ def extract_status_change(
     return was_member, is_member
 
 
+async def _reply_unavailable(update: Update, e: CircuitOpen, quiet: bool) -> None:
+    metrics.inc("executor_fast_failures_total")
+    if not quiet:
+        await update.message.reply_text(
+            "Tekshiruv xizmati vaqtincha ishlamayapti, "
+            f"taxminan {max(int(e.retry_after), 1)} soniyadan so'ng qayta urinib ko'ring."
+        )
+
+
+async def run_submission(
+    update: Update, tests: str, code: str, quiet: bool = False, batch: bool = True
+) -> Optional[ExecutionResult]:
+    """Runs code against tests through the result cache and the judge queue.
+
+    Returns None when the run could not be scheduled or failed, after telling
+    the user why unless ``quiet`` is set. Timed runs should pass ``batch=False``
+    so they do not share the sandbox with other submissions.
+    """
+    execution = await result_cache.get(tests, code)
+    if execution is not None:
+        return execution
+
+    try:
+        position, pending_execution = judge.submit(
+            update.effective_chat.id, tests, code, batch
+        )
+    except CircuitOpen as e:
+        await _reply_unavailable(update, e, quiet)
+        return None
+    except QueueFull:
+        if not quiet:
+            await update.message.reply_text(
+                "Navbat to'lgan, birozdan so'ng qayta yuboring."
+            )
+        return None
+    if position and not quiet:
+        await update.message.reply_text(
+            f"Kodingiz navbatga qo'yildi, navbatdagi o'rningiz: {position}"
+        )
+
+    try:
+        execution = await pending_execution
+    except CircuitOpen as e:
+        await _reply_unavailable(update, e, quiet)
+        return None
+    except ExecutorError as e:
+        logger.warning(
+            "execution failed for {}: {}".format(update.effective_chat.id, e)
+        )
+        if not quiet:
+            await update.message.reply_text(
+                "Kodni tekshirib bo'lmadi, birozdan so'ng qayta urinib ko'ring."
+            )
+        return None
+    await result_cache.put(tests, code, execution)
+    return execution
+
+
+async def current_challenge(context: ContextTypes.DEFAULT_TYPE) -> Optional[Challenge]:
+    challenge_id = context.bot_data.get("challenge_id")
+    return await challenges.get(challenge_id) if challenge_id else None
+
+
+async def selected_challenge(
+    context: ContextTypes.DEFAULT_TYPE,
+) -> Optional[Challenge]:
+    """The challenge the chat picked with /masala, today's one otherwise."""
+    challenge_id = context.chat_data.get("challenge_id")
+    if challenge_id:
+        return await challenges.get(challenge_id)
+    return await current_challenge(context)
+
+
+def tracked_chats(bot_data: dict) -> Set[int]:
+    """Private chats and groups collected by track_chats."""
+    return bot_data.get("user_ids", set()) | bot_data.get("group_ids", set())
+
+
+def forget_chat(bot_data: dict, chat_id: int) -> None:
+    """Stops tracking a chat that blocked the bot or no longer exists."""
+    bot_data.setdefault("user_ids", set()).discard(chat_id)
+    bot_data.setdefault("group_ids", set()).discard(chat_id)
+
+
 """Handlers"""
 
 
 async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("/start from {}".format(update.effective_chat.id))
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE chat_id = ?", (update.effective_chat.id,))
-    user_found = cursor.fetchone()
-    if not user_found:
-        cursor.execute(
-            "INSERT INTO users (chat_id, username, full_name, solved_challenges, points) VALUES (?, ?, ?, ?, ?)",
-            (
-                update.effective_chat.id,
-                update.effective_user.username,
-                update.effective_user.full_name,
-                json.dumps([]),
-                0,
-            ),
-        )
-        conn.commit()
-    conn.close()
+    await db.add_user(
+        update.effective_chat.id,
+        update.effective_user.username,
+        update.effective_user.full_name,
+    )
 
     if update.effective_user.username:
         context.chat_data["username"] = f"@{update.effective_user.username}"
@@ -176,85 +313,122 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
 
 async def code_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    started = time.perf_counter()
     user_code_string: str = ""
-    if not context.bot_data.get("tests"):
+    challenge = await selected_challenge(context)
+    if challenge is None or not challenge.tests:
         return
-    challenge_test_string: str = context.bot_data.get("tests")
+    challenge_test_string: str = challenge.tests
 
     if update.message.text:
         user_code_string = update.message.text
     elif update.message.document:
-        file_link: File = await context.bot.get_file(update.message.document.file_id)
-        file = urlopen(file_link.file_path)
-        for line in file:
-            user_code_string += line.decode("utf-8")
+        try:
+            with metrics.timer("code_handler_stage_seconds", stage="download"):
+                user_code_string = await downloader.fetch_text(
+                    context.bot, update.message.document
+                )
+        except DocumentTooLarge as e:
+            await update.message.reply_text(
+                f"Fayl juda katta, ruxsat etilgan hajm: {e.limit // 1024} KB"
+            )
+            return
+        except DocumentDecodeError as e:
+            await update.message.reply_text(
+                f"Faylni UTF-8 matn sifatida o'qib bo'lmadi ({e.line}-qator)"
+            )
+            return
 
+    log_fields = {
+        "chat_id": update.effective_chat.id,
+        "challenge_id": challenge.id,
+    }
     logger.info(
-        "received code\n{}\nfrom {}".format(user_code_string, update.effective_chat.id)
+        "received code", extra={**log_fields, "code_length": len(user_code_string)}
     )
+    source_logger.info(user_code_string, extra=log_fields)
+    metrics.inc("submissions_total")
+
+    try:
+        with metrics.timer("code_handler_stage_seconds", stage="preflight"):
+            checked = await preflight(
+                user_code_string,
+                challenge_test_string,
+                max_bytes=downloader.max_bytes,
+                max_nodes=PREFLIGHT_MAX_NODES,
+                max_depth=PREFLIGHT_MAX_DEPTH,
+            )
+    except PreflightError as e:
+        metrics.inc("preflight_rejects_total")
+        await update.message.reply_text(str(e))
+        return
 
-    data = {
-        "files": [
-            {"name": "tests.py", "content": challenge_test_string},
-            {"name": "user_code.py", "content": user_code_string},
-        ]
-    }
-
-    req = requests.post(url=GLOT_URL, json=data, headers=headers)
-    req_json = req.json()
-    test_output = req_json.get("stderr")
+    with metrics.timer("code_handler_stage_seconds", stage="execute"):
+        execution = await run_submission(
+            update, challenge_test_string, user_code_string
+        )
+    if execution is None:
+        return
+    test_output = execution.stderr
 
     if DIVIDER in test_output:
         text: str = test_output[test_output.find(DIVIDER) :]
         text = text.replace(DIVIDER, "---")
     else:
         text: str = test_output
-    if text.endswith("OK\n") and DEVELOPER_CHAT_ID != str(update.effective_chat.id):
+    accepted = text.endswith("OK\n")
+    metrics.inc("accepts_total" if accepted else "failures_total")
+    if accepted and DEVELOPER_CHAT_ID != str(update.effective_chat.id):
         username: str = context.chat_data["username"]
         result: float = float(re.search(r"\d+\.\d+", text).group())
+        timings: Optional[str] = None
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        challenge_id = context.bot_data["challenge_id"]
-        cursor.execute(
-            "SELECT * FROM solvers WHERE challenge_id = ? AND user = ?",
-            (challenge_id, username),
-        )
-        solver_found = cursor.fetchone()
-
-        if not solver_found:
-            cursor.execute(
-                "SELECT * FROM users WHERE chat_id = ?", (update.effective_chat.id,)
+        if BENCHMARK_REPEAT:
+            harness = build_harness(
+                challenge_test_string, BENCHMARK_REPEAT, BENCHMARK_WARMUP
             )
-            user = cursor.fetchone()
-            if user:
-                solved_challenges = json.loads(user["solved_challenges"])
-                solved_challenges.append(challenge_id)
-                new_points = user["points"] + 1
-                cursor.execute(
-                    "UPDATE users SET solved_challenges = ?, points = ? WHERE chat_id = ?",
-                    (
-                        json.dumps(solved_challenges),
-                        new_points,
-                        update.effective_chat.id,
-                    ),
+            with metrics.timer("code_handler_stage_seconds", stage="benchmark"):
+                benchmark = await run_submission(
+                    update, harness, user_code_string, quiet=True, batch=False
+                )
+            report = parse_report(benchmark.stdout) if benchmark else None
+            if report:
+                result = report["total"]["median"]
+                timings = json.dumps(report)
+            else:
+                logger.warning(
+                    "benchmark failed for {}, ranking on unittest time".format(
+                        update.effective_chat.id
+                    )
                 )
 
-        # Using INSERT OR REPLACE for upsert behavior
-        cursor.execute(
-            """INSERT OR REPLACE INTO solvers (challenge_id, user, result, solution, code_length)
-               VALUES (?, ?, ?, ?, ?)""",
-            (challenge_id, username, result, user_code_string, len(user_code_string)),
-        )
-
-        conn.commit()
-        conn.close()
+        with metrics.timer("code_handler_stage_seconds", stage="record"):
+            await solve_buffer.add(
+                Solve(
+                    update.effective_chat.id,
+                    challenge.id,
+                    username,
+                    result,
+                    user_code_string,
+                    checked.token_length,
+                    timings,
+                    checked.fingerprint,
+                )
+            )
         await update.message.reply_text("✅")
 
     text = re.sub(r"<([^>]+)>", r"\1", text)
 
-    await update.message.reply_html(text=f"<code>{text}</code>")
+    with metrics.timer("code_handler_stage_seconds", stage="reply"):
+        await update.message.reply_html(text=f"<code>{text}</code>")
+    logger.info(
+        "judged code",
+        extra={
+            **log_fields,
+            "accepted": accepted,
+            "latency": round(time.perf_counter() - started, 4),
+        },
+    )
 
 
 async def new_challenge_handler(update: Update, _) -> int:
@@ -303,38 +477,25 @@ async def challenge_tests_handler(
     if update.message.text:
         challenge_test_string = update.message.text_markdown_v2.replace("`", "")
     else:
-        test_file_link = await context.bot.get_file(update.message.document.file_id)
-        test_file = urlopen(test_file_link.file_path)
-        for line in test_file:
-            challenge_test_string += line.decode("utf-8")
+        try:
+            challenge_test_string = await downloader.fetch_text(
+                context.bot, update.message.document, max_bytes=MAX_TESTS_BYTES
+            )
+        except (DocumentTooLarge, DocumentDecodeError) as e:
+            await update.message.reply_text(f"Could not read test file: {e}")
+            return CHALLENGE_TEST
 
     logger.info("challenge_test_string\n{}".format(challenge_test_string))
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    cursor.execute(
-        "INSERT INTO challenges (description, solution_photo_id, solution_text, tests) VALUES (?, ?, ?, ?)",
-        (
-            context.user_data["current_challenge_description"],
-            context.user_data["current_challenge_solution_photo_id"],
-            context.user_data["current_challenge_solution_text"],
-            challenge_test_string,
-        ),
+    challenge_id = await db.add_challenge(
+        context.user_data["current_challenge_description"],
+        context.user_data["current_challenge_solution_photo_id"],
+        context.user_data["current_challenge_solution_text"],
+        challenge_test_string,
     )
-    challenge_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-
-    challenge_dict = {
-        "challenge_id": challenge_id,
-        "description": context.user_data["current_challenge_description"],
-        "solution_photo_id": context.user_data["current_challenge_solution_photo_id"],
-        "solution_text": context.user_data["current_challenge_solution_text"],
-        "tests": challenge_test_string,
-    }
 
-    context.bot_data.update(challenge_dict)
+    context.bot_data["challenge_id"] = challenge_id
+    await result_cache.clear()
 
     logger.info("added new challenge")
 
@@ -346,21 +507,48 @@ async def challenge_info_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
     logger.info("/bugungi_masala from {}".format(update.effective_chat.id))
-    task_description = context.bot_data.get("description")
-    if task_description:
-        await update.message.reply_html(task_description)
+    challenge = await current_challenge(context)
+    if challenge and challenge.description:
+        await update.message.reply_html(challenge.description)
     else:
         await update.message.reply_text("masala topilmadi")
 
 
+async def select_challenge_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    logger.info("/masala from {}".format(update.effective_chat.id))
+    if not context.args:
+        context.chat_data.pop("challenge_id", None)
+        await update.message.reply_text(
+            "Kodlaringiz bugungi masala bo'yicha tekshiriladi.\n"
+            "Boshqa masalani tanlash uchun: /masala <raqam>"
+        )
+        return
+
+    challenge = None
+    if context.args[0].isdigit():
+        challenge = await challenges.get(int(context.args[0]))
+    if challenge is None or not challenge.tests:
+        await update.message.reply_text("masala topilmadi")
+        return
+    context.chat_data["challenge_id"] = challenge.id
+    await update.message.reply_text(
+        f"Endi kodlaringiz {challenge.id}-masala bo'yicha tekshiriladi.\n"
+        "Bugungi masalaga qaytish uchun /masala buyrug'ini yuboring."
+    )
+    if challenge.description:
+        await update.message.reply_html(challenge.description)
+
+
 async def post_bugungi_masala_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
     logger.info("/post_bugungi_masala from {}".format(update.effective_chat.id))
     if str(update.message.chat_id) == DEVELOPER_CHAT_ID:
-        task_description = context.bot_data.get("description")
-        if task_description:
-            task_description = "Yangi masala:\n\n" + task_description
+        challenge = await current_challenge(context)
+        if challenge and challenge.description:
+            task_description = "Yangi masala:\n\n" + challenge.description
             await context.bot.send_message(
                 CHANNEL_ID, task_description, parse_mode=ParseMode.HTML
             )
@@ -368,6 +556,45 @@ async def post_bugungi_masala_handler(
             await update.message.reply_text("masala topilmadi")
 
 
+async def broadcast_challenge_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    logger.info("/broadcast_masala from {}".format(update.effective_chat.id))
+    if str(update.message.chat_id) != DEVELOPER_CHAT_ID:
+        await update.message.reply_text("Sorry, I do not know this command")
+        return
+    challenge = await current_challenge(context)
+    if not challenge or not challenge.description:
+        await update.message.reply_text("masala topilmadi")
+        return
+    await broadcaster.broadcast(
+        context.bot,
+        text_message("Yangi masala:\n\n" + challenge.description),
+        tracked_chats(context.bot_data),
+        update.effective_chat.id,
+    )
+
+
+async def broadcast_solution_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    logger.info("/broadcast_yechim from {}".format(update.effective_chat.id))
+    if str(update.message.chat_id) != DEVELOPER_CHAT_ID:
+        await update.message.reply_text("Sorry, I do not know this command")
+        return
+    challenge = await current_challenge(context)
+    if challenge and challenge.solution_photo_id:
+        message = photo_message(challenge.solution_photo_id, caption="Yechim")
+    elif challenge and challenge.solution_text:
+        message = text_message("Yechim:\n\n" + challenge.solution_text)
+    else:
+        await update.message.reply_text("no solution photo found")
+        return
+    await broadcaster.broadcast(
+        context.bot, message, tracked_chats(context.bot_data), update.effective_chat.id
+    )
+
+
 async def help_handler(update: Update, _) -> None:
     logger.info("/yordam from {}".format(update.effective_chat.id))
     text: str = (
@@ -375,6 +602,7 @@ async def help_handler(update: Update, _) -> None:
         "Bugungi masalani tasvirlash uchun /bugungi_masala buyrug'ini yuboring.\n"
         "Peshqadamlar ro'yxatini ko'rsatish uchun /top buyrug'ini yuboring.\n"
         "Bugungi masala bo'yicha peshqadamlar ro'yxatini ko'rsatish uchun /bugungi_top buyrug'ini yuboring.\n"
+        "Avvalgi masalalarga kod yuborish uchun /masala <raqam> buyrug'ini yuboring.\n"
     )
 
     await update.message.reply_text(text)
@@ -383,8 +611,9 @@ async def help_handler(update: Update, _) -> None:
 async def solution_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("/yechim from {}".format(update.effective_chat.id))
     if str(update.message.chat_id) == DEVELOPER_CHAT_ID:
-        solution_photo_id = context.bot_data.get("solution_photo_id")
-        solution_text = context.bot_data.get("solution_text")
+        challenge = await current_challenge(context)
+        solution_photo_id = challenge.solution_photo_id if challenge else None
+        solution_text = challenge.solution_text if challenge else None
         logger.info(solution_photo_id)
         if solution_photo_id:
             await update.message.reply_photo(solution_photo_id)
@@ -403,8 +632,9 @@ async def post_solution_handler(
 ) -> None:
     logger.info("/post_yechim from {}".format(update.effective_chat.id))
     if str(update.message.chat_id) == DEVELOPER_CHAT_ID:
-        solution_photo_id = context.bot_data.get("solution_photo_id")
-        solution_text = context.bot_data.get("solution_text")
+        challenge = await current_challenge(context)
+        solution_photo_id = challenge.solution_photo_id if challenge else None
+        solution_text = challenge.solution_text if challenge else None
         logger.info(solution_photo_id)
         if solution_photo_id:
             await context.bot.send_photo(
@@ -425,21 +655,12 @@ async def post_solution_handler(
 
 async def leaderboard_handler(update: Update, _) -> None:
     logger.info("/top from {}".format(update.effective_chat.id))
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE points > 0 ORDER BY points DESC LIMIT 10")
-    users = cursor.fetchall()
-    conn.close()
-
-    text: str = ""
-
-    if users:
-        for i, user in enumerate(users, 1):
-            username = f"@{user['username']}" if user["username"] else user["full_name"]
-            text += f"{i}. {username} - {user['points']} ball\n"
-    else:
-        text = "hali aniqlanmagan"
-    await update.message.reply_text(text)
+    await solve_buffer.sync(update.effective_chat.id)
+    text, markup = await leaderboards.page(Cursor(POINTS))
+    rank = await leaderboards.rank_line(update.effective_chat.id)
+    if rank:
+        text += f"\n\n{rank}"
+    await update.message.reply_text(text, reply_markup=markup)
 
 
 async def todays_leaderboard_handler(
@@ -451,63 +672,43 @@ async def todays_leaderboard_handler(
         await update.message.reply_text("Bugun uchun masala topilmadi.")
         return
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    text: str = ""
-
-    cursor.execute(
-        "SELECT * FROM solvers WHERE challenge_id = ? ORDER BY result ASC LIMIT 10",
-        (challenge_id,),
-    )
-    solvers_by_speed = cursor.fetchall()
+    await solve_buffer.sync(update.effective_chat.id)
+    text, markup = await leaderboards.page(Cursor(TODAY, challenge_id))
+    rank = await leaderboards.rank_line(update.effective_chat.id, challenge_id)
+    if rank:
+        text += f"\n\n{rank}"
+    await update.message.reply_text(text, reply_markup=markup)
 
-    cursor.execute(
-        "SELECT * FROM solvers WHERE challenge_id = ? ORDER BY code_length ASC LIMIT 10",
-        (challenge_id,),
-    )
-    solvers_by_length = cursor.fetchall()
-    conn.close()
 
-    if not solvers_by_speed and not solvers_by_length:
-        await update.message.reply_text("hali aniqlanmagan")
+async def leaderboard_page_handler(update: Update, _) -> None:
+    query = update.callback_query
+    try:
+        cursor = Cursor.unpack(query.data)
+    except ValueError:
+        await query.answer()
         return
-
-    if solvers_by_speed:
-        text += "Tezlik:\n"
-        for i, solver in enumerate(solvers_by_speed, 1):
-            text += f"{i}. {solver['user']} - {solver['result']}s\n"
-
-    if solvers_by_length:
-        if text:
-            text += "\n---\n\n"
-        text += "Qisqalik:\n"
-        for i, solver in enumerate(solvers_by_length, 1):
-            text += f"{i}. {solver['user']} - {solver['code_length']} belgi\n"
-
-    await update.message.reply_text(text)
+    text, markup = await leaderboards.page(cursor)
+    await query.answer()
+    try:
+        await query.edit_message_text(text, reply_markup=markup)
+    except BadRequest as e:
+        # Pressing a button twice renders the same page again
+        if "not modified" not in str(e):
+            raise
 
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error("Exception while handling an update:", exc_info=context.error)
 
-    tb_list = traceback.format_exception(
-        None, context.error, context.error.__traceback__
-    )
-    tb_string = "".join(tb_list)
-
     update_str = update.to_dict() if isinstance(update, Update) else str(update)
-    message = (
-        f"An exception was raised while handling an update\n"
-        f"<pre>update = {html.escape(json.dumps(update_str, indent=2, ensure_ascii=False))}"
-        "</pre>\n\n"
-        f"<pre>context.chat_data = {html.escape(str(context.chat_data))}</pre>\n\n"
-        f"<pre>context.user_data = {html.escape(str(context.user_data))}</pre>\n\n"
-        f"<pre>{html.escape(tb_string)}</pre>"
-    )
-
-    await context.bot.send_message(
-        chat_id=DEVELOPER_CHAT_ID, text=message, parse_mode=ParseMode.HTML
+    await error_reporter.report(
+        context.bot,
+        context.error,
+        {
+            "update": update_str,
+            "chat_data": context.chat_data,
+            "user_data": context.user_data,
+        },
     )
 
 
@@ -574,35 +775,251 @@ async def show_chats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         await update.effective_message.reply_text("Sorry, I do not know this command")
 
 
+async def stats_handler(update: Update, _) -> None:
+    chat_id = str(update.effective_chat.id)
+
+    if chat_id == DEVELOPER_CHAT_ID:
+        await update.effective_message.reply_text(metrics.render_summary()[:4096])
+    else:
+        await update.effective_message.reply_text("Sorry, I do not know this command")
+
+
+async def rejudge_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/rejudge <challenge_id>, as a reply to a test file to replace the tests first."""
+    chat_id = str(update.effective_chat.id)
+
+    if chat_id != DEVELOPER_CHAT_ID:
+        await update.effective_message.reply_text("Sorry, I do not know this command")
+        return
+    if len(context.args) != 1 or not context.args[0].isdigit():
+        await update.effective_message.reply_text("Usage: /rejudge <challenge_id>")
+        return
+    challenge_id = int(context.args[0])
+    if rejudger.running(challenge_id):
+        await update.effective_message.reply_text(
+            f"Challenge {challenge_id} is already being re-judged"
+        )
+        return
+
+    replied = update.message.reply_to_message
+    if replied and replied.document:
+        try:
+            tests = await downloader.fetch_text(
+                context.bot, replied.document, max_bytes=MAX_TESTS_BYTES
+            )
+        except (DocumentTooLarge, DocumentDecodeError) as e:
+            await update.message.reply_text(f"Could not read test file: {e}")
+            return
+        if not await db.update_challenge_tests(challenge_id, tests):
+            await update.message.reply_text(f"Challenge {challenge_id} not found")
+            return
+        challenges.invalidate(challenge_id)
+        logger.info("replaced tests of challenge {}".format(challenge_id))
+
+    rejudger.start(context.bot, challenge_id, update.effective_chat.id)
+
+
+async def error_details_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """/error <id> sends a stored error, /error lists the last day's errors."""
+    chat_id = str(update.effective_chat.id)
+
+    if chat_id != DEVELOPER_CHAT_ID:
+        await update.effective_message.reply_text("Sorry, I do not know this command")
+        return
+    if not context.args:
+        rows = await db.recent_errors(time.time() - 86400)
+        if not rows:
+            await update.effective_message.reply_text("No errors in the last day")
+            return
+        lines = [
+            f"{row['count']}x {row['type']} [{row['fingerprint']}] "
+            f"/error {row['last_id']}: {row['message'][:100]}"
+            for row in rows
+        ]
+        await update.effective_message.reply_text("\n".join(lines)[:4096])
+        return
+    if len(context.args) != 1 or not context.args[0].isdigit():
+        await update.effective_message.reply_text("Usage: /error [error_id]")
+        return
+
+    row = await db.get_error(int(context.args[0]))
+    if row is None:
+        await update.effective_message.reply_text("Error not found")
+        return
+    details = (
+        f"{row['type']} [{row['fingerprint']}] at "
+        f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['created']))}\n\n"
+        f"{row['traceback']}\n{row['context']}\n"
+    )
+    await update.effective_message.reply_document(
+        details.encode("utf-8"), filename=f"error_{row['id']}.txt"
+    )
+
+
+async def duplicates_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """/duplicates <challenge_id> lists copied and near-copied solutions."""
+    chat_id = str(update.effective_chat.id)
+
+    if chat_id != DEVELOPER_CHAT_ID:
+        await update.effective_message.reply_text("Sorry, I do not know this command")
+        return
+    if len(context.args) != 1 or not context.args[0].isdigit():
+        await update.effective_message.reply_text("Usage: /duplicates <challenge_id>")
+        return
+    challenge_id = int(context.args[0])
+
+    exact = await db.exact_duplicates(challenge_id)
+    near = await db.near_duplicates(
+        challenge_id, threshold=float(environ.get("DUPLICATE_THRESHOLD", 0.8))
+    )
+    if not exact and not near:
+        await update.effective_message.reply_text(
+            f"No duplicates in challenge {challenge_id}"
+        )
+        return
+    lines = [f"Challenge {challenge_id}"]
+    if exact:
+        lines.append("\nSame solution:")
+        lines.extend(", ".join(users) for users in exact)
+    if near:
+        lines.append("\nNear copies:")
+        lines.extend(
+            f"{row['similarity']:.0%} {row['user_a']} ~ {row['user_b']}" for row in near
+        )
+    await update.effective_message.reply_text("\n".join(lines)[:4096])
+
+
+# Bots can upload files up to 50 MB
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+EXPORT_BATCH_SIZE = int(environ.get("EXPORT_BATCH_SIZE", 500))
+
+
+async def send_export(bot: Bot, path: str, rows: int) -> None:
+    size = os.path.getsize(path)
+    if size > MAX_UPLOAD_BYTES:
+        await bot.send_message(
+            DEVELOPER_CHAT_ID,
+            f"{os.path.basename(path)} is {size / 2**20:.1f} MiB, too large to "
+            "send. Compress it with gz or export it on the server with "
+            "python main.py export",
+        )
+        return
+    with open(path, "rb") as document:
+        await bot.send_document(
+            DEVELOPER_CHAT_ID,
+            document,
+            filename=os.path.basename(path),
+            caption=f"{rows} rows",
+        )
+
+
+async def export_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/export <table> [csv|jsonl] [gz] sends a table as a file."""
+    chat_id = str(update.effective_chat.id)
+
+    if chat_id != DEVELOPER_CHAT_ID:
+        await update.effective_message.reply_text("Sorry, I do not know this command")
+        return
+    args = [arg for arg in context.args if arg != "gz"]
+    compress = len(args) != len(context.args)
+    table = args[0] if args else None
+    fmt = args[1] if len(args) > 1 else "csv"
+    if table not in QUERIES or fmt not in FORMATS or len(args) > 2:
+        await update.effective_message.reply_text(
+            f"Usage: /export <{'|'.join(QUERIES)}> [{'|'.join(FORMATS)}] [gz]"
+        )
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, export_filename(table, fmt, compress))
+        rows = await export(DB_FILE, table, path, fmt, compress, EXPORT_BATCH_SIZE)
+        await send_export(context.bot, path, rows)
+
+
+async def compact_handler(update: Update, _) -> None:
+    chat_id = str(update.effective_chat.id)
+
+    if chat_id != DEVELOPER_CHAT_ID:
+        await update.effective_message.reply_text("Sorry, I do not know this command")
+        return
+    await update.effective_message.reply_text("Compacting the database...")
+    before, after = await db.compact()
+    await update.effective_message.reply_text(
+        f"Database compacted: {before / 2**20:.1f} MiB -> {after / 2**20:.1f} MiB"
+    )
+
+
 """Main"""
 
 
+async def post_init(app: Application) -> None:
+    # Only the current challenge id lives in bot_data, challenges themselves
+    # are loaded on demand
+    for key in ("description", "solution_photo_id", "solution_text", "tests"):
+        app.bot_data.pop(key, None)
+    latest_challenge_id = await db.latest_challenge_id()
+    if latest_challenge_id:
+        app.bot_data["challenge_id"] = latest_challenge_id
+        logger.info(f"Loaded latest challenge {latest_challenge_id} from DB.")
+
+    await executor.start()
+    await judge.start()
+    await downloader.start()
+    if METRICS_PORT:
+        await metrics_server.start()
+    await rejudger.resume(app.bot)
+    broadcaster.on_gone = functools.partial(forget_chat, app.bot_data)
+    await broadcaster.resume(app.bot)
+
+
+async def post_shutdown(_: Application) -> None:
+    await metrics_server.close()
+    await error_reporter.close()
+    await rejudger.stop()
+    await broadcaster.stop()
+    await judge.stop()
+    await executor.close()
+    await downloader.close()
+    await solve_buffer.close()
+    await db.close()
+
+
 def main() -> None:
-    setup_database()
-    persistence = PicklePersistence(filepath="persistence.pickle")
-
-    app = Application.builder().token(environ["TOKEN"]).persistence(persistence).build()
-
-    # Load the latest challenge into bot_data on startup
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM challenges ORDER BY id DESC LIMIT 1")
-    latest_challenge = cursor.fetchone()
-    conn.close()
-    if latest_challenge:
-        challenge_dict = {
-            "challenge_id": latest_challenge["id"],
-            "description": latest_challenge["description"],
-            "solution_photo_id": latest_challenge["solution_photo_id"],
-            "solution_text": latest_challenge["solution_text"],
-            "tests": latest_challenge["tests"],
-        }
-        app.bot_data.update(challenge_dict)
-        logger.info(f"Loaded latest challenge {latest_challenge['id']} from DB.")
+    log_listener = setup_logging(
+        "syccbot.log",
+        max_bytes=int(environ.get("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+        backup_count=int(environ.get("LOG_BACKUP_COUNT", 10)),
+        when=environ.get("LOG_ROTATE_WHEN"),
+        source_filename="submissions.log",
+        source_sample_rate=float(environ.get("SOURCE_LOG_SAMPLE_RATE", 0)),
+    )
+    db.setup()
+    persistence = SQLitePersistence(
+        "persistence.db",
+        legacy_pickle="persistence.pickle",
+        update_interval=float(environ.get("PERSISTENCE_UPDATE_INTERVAL", 60)),
+    )
+
+    app = (
+        Application.builder()
+        .token(environ["TOKEN"])
+        .concurrent_updates(
+            PerChatUpdateProcessor(int(environ.get("CONCURRENT_UPDATES", 64)))
+        )
+        .persistence(persistence)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     app.add_handler(CommandHandler("start", start_handler))
 
     app.add_handler(CommandHandler("bugungi_masala", challenge_info_handler))
+    app.add_handler(CommandHandler("masala", select_challenge_handler))
 
     app.add_handler(CommandHandler("yechim", solution_handler))
 
@@ -611,9 +1028,12 @@ def main() -> None:
     app.add_handler(CommandHandler("top", leaderboard_handler))
 
     app.add_handler(CommandHandler("bugungi_top", todays_leaderboard_handler))
+    app.add_handler(CallbackQueryHandler(leaderboard_page_handler, pattern=r"^lb\|"))
 
     app.add_handler(CommandHandler("post_bugungi_masala", post_bugungi_masala_handler))
     app.add_handler(CommandHandler("post_yechim", post_solution_handler))
+    app.add_handler(CommandHandler("broadcast_masala", broadcast_challenge_handler))
+    app.add_handler(CommandHandler("broadcast_yechim", broadcast_solution_handler))
 
     new_challenge_conversation = ConversationHandler(
         entry_points=[CommandHandler("yangi_masala", new_challenge_handler)],
@@ -653,10 +1073,78 @@ def main() -> None:
     )
     app.add_handler(ChatMemberHandler(track_chats, ChatMemberHandler.MY_CHAT_MEMBER))
     app.add_handler(CommandHandler("show_chats", show_chats))
+    app.add_handler(CommandHandler("stats", stats_handler))
+    app.add_handler(CommandHandler("rejudge", rejudge_handler))
+    app.add_handler(CommandHandler("error", error_details_handler))
+    app.add_handler(CommandHandler("compact", compact_handler))
+    app.add_handler(CommandHandler("duplicates", duplicates_handler))
+    app.add_handler(CommandHandler("export", export_handler))
     app.add_error_handler(error_handler)
 
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    instrument_handlers(
+        [handler for group in app.handlers.values() for handler in group]
+    )
+
+    try:
+        if environ.get("WEBHOOK_URL"):
+            url_path = environ.get("WEBHOOK_PATH", "telegram")
+            app.run_webhook(
+                listen=environ.get("WEBHOOK_LISTEN", "127.0.0.1"),
+                port=int(environ.get("WEBHOOK_PORT", 8443)),
+                url_path=url_path,
+                webhook_url=f"{environ['WEBHOOK_URL'].rstrip('/')}/{url_path}",
+                secret_token=environ.get("WEBHOOK_SECRET"),
+                allowed_updates=Update.ALL_TYPES,
+            )
+        else:
+            app.run_polling(allowed_updates=Update.ALL_TYPES)
+    finally:
+        log_listener.stop()
+
+
+def export_main(argv: Optional[List[str]] = None) -> None:
+    """python main.py export [tables...] writes tables next to the database."""
+    parser = argparse.ArgumentParser(
+        prog="main.py export", description="Export bot data to CSV or JSON Lines"
+    )
+    parser.add_argument(
+        "tables", nargs="*", help=f"any of {', '.join(QUERIES)}, all by default"
+    )
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--gzip", action="store_true", help="compress the files")
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument(
+        "--send", action="store_true", help="also send the files to the developer"
+    )
+    args = parser.parse_args(argv)
+    unknown = set(args.tables) - set(QUERIES)
+    if unknown:
+        parser.error(f"cannot export {', '.join(sorted(unknown))}")
+
+    exported = []
+    for table in args.tables or list(QUERIES):
+        path = os.path.join(
+            args.output_dir, export_filename(table, args.format, args.gzip)
+        )
+        rows = export_table(
+            DB_FILE, table, path, args.format, args.gzip, args.batch_size
+        )
+        print(f"{path}: {rows} rows")
+        exported.append((path, rows))
+
+    if args.send:
+
+        async def send() -> None:
+            async with Bot(environ["TOKEN"]) as bot:
+                for path, rows in exported:
+                    await send_export(bot, path, rows)
+
+        asyncio.run(send())
 
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:2] == ["export"]:
+        export_main(sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,230 @@
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """In-process counters, gauges and latency histograms."""
+
+    def __init__(self) -> None:
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.gauges: Dict[str, Dict[Labels, float]] = {}
+        self.gauge_callbacks: Dict[str, Callable[[], float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: object) -> None:
+        series = self.counters.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels: object) -> None:
+        self.gauges.setdefault(name, {})[_labels(labels)] = value
+
+    def add_gauge(self, name: str, value: float, **labels: object) -> None:
+        series = self.gauges.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def register_gauge(self, name: str, callback: Callable[[], float]) -> None:
+        """Reads the gauge from ``callback`` whenever metrics are exported."""
+        self.gauge_callbacks[name] = callback
+
+    def observe(self, name: str, value: float, **labels: object) -> None:
+        series = self.histograms.setdefault(name, {})
+        key = _labels(labels)
+        if key not in series:
+            series[key] = Histogram()
+        series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: object) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+        for name, series in sorted(self.counters.items()):
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        gauges = {name: dict(series) for name, series in self.gauges.items()}
+        for name, callback in self.gauge_callbacks.items():
+            gauges.setdefault(name, {})[()] = callback()
+        for name, series in sorted(gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in series.items():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    bucket = _format_labels(labels, ("le", str(bound)))
+                    lines.append(f"{name}_bucket{bucket} {cumulative}")
+                bucket = _format_labels(labels, ("le", "+Inf"))
+                lines.append(f"{name}_bucket{bucket} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def render_summary(self) -> str:
+        """Short plain-text overview for the /stats command."""
+        lines: List[str] = []
+        for name, series in sorted(self.counters.items()):
+            for labels, value in series.items():
+                lines.append(f"{name}{_format_labels(labels)}: {value:g}")
+        gauges = {name: dict(series) for name, series in self.gauges.items()}
+        for name, callback in self.gauge_callbacks.items():
+            gauges.setdefault(name, {})[()] = callback()
+        for name, series in sorted(gauges.items()):
+            for labels, value in series.items():
+                lines.append(f"{name}{_format_labels(labels)}: {value:g}")
+        for name, series in sorted(self.histograms.items()):
+            for labels, histogram in series.items():
+                mean = histogram.sum / histogram.count if histogram.count else 0
+                lines.append(
+                    f"{name}{_format_labels(labels)}: n={histogram.count} "
+                    f"mean={mean:.3f}s p50<={histogram.quantile(0.5)}s "
+                    f"p95<={histogram.quantile(0.95)}s"
+                )
+        return "\n".join(lines) or "no metrics yet"
+
+
+metrics = Metrics()
+
+
+def instrument(callback: Callable, name: Optional[str] = None) -> Callable:
+    """Wraps an async handler callback to record its latency and failures."""
+    name = name or callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            metrics.inc("handler_errors_total", handler=name)
+            raise
+        finally:
+            metrics.observe(
+                "handler_latency_seconds", time.perf_counter() - started, handler=name
+            )
+
+    return wrapper
+
+
+def instrument_handlers(handlers: List) -> None:
+    """Instruments handlers in place, descending into ConversationHandlers."""
+    for handler in handlers:
+        if hasattr(handler, "entry_points"):
+            instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers)
+            instrument_handlers(handler.fallbacks)
+        elif hasattr(handler, "callback"):
+            handler.callback = instrument(handler.callback)
+
+
+class MetricsServer:
+    """Serves the Prometheus text format on ``GET /metrics``."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9100) -> None:
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("serving metrics on {}:{}".format(self.host, self.port))
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            if request_line.split(b" ")[:2] == [b"GET", b"/metrics"]:
+                status, body = "200 OK", metrics.render_prometheus()
+            else:
+                status, body = "404 Not Found", "not found\n"
+            payload = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                "Connection: close\r\n\r\n".encode("ascii") + payload
+            )
+            await writer.drain()
+        finally:
+            writer.close()
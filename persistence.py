@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import pickle
+import sqlite3
+from copy import deepcopy
+from typing import Any, Dict, Optional
+
+from telegram.ext import BasePersistence, PersistenceInput, PicklePersistence
+from telegram.ext._utils.types import CDCData, ConversationDict, ConversationKey
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+_TABLES = ("bot_data", "chat_data", "user_data", "conversations", "callback_data")
+
+
+def _setup(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS bot_data (key TEXT PRIMARY KEY, value BLOB)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS chat_data (chat_id INTEGER PRIMARY KEY, value BLOB)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, value BLOB)"
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS conversations (
+            name TEXT,
+            key TEXT,
+            state BLOB,
+            PRIMARY KEY (name, key)
+        )
+    """
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS callback_data (id INTEGER PRIMARY KEY, value BLOB)"
+    )
+
+
+def _dumps(value: Any) -> bytes:
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class SQLitePersistence(BasePersistence):
+    """Keeps bot, chat and user data and conversation states in SQLite.
+
+    Every entry is its own row, so a flush only rewrites what changed: bot_data
+    is diffed key by key against the last persisted snapshot, and chat/user
+    data and conversation states are only handed over by the application
+    when they were touched. On first start an existing PicklePersistence file
+    is imported.
+    """
+
+    def __init__(
+        self,
+        filepath: str,
+        legacy_pickle: Optional[str] = None,
+        store_data: Optional[PersistenceInput] = None,
+        update_interval: float = 60,
+    ) -> None:
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.filepath = filepath
+        self.legacy_pickle = legacy_pickle
+        self.db = Database(filepath, readers=1)
+        self._loaded = False
+        self._bot_data: Dict[str, Any] = {}
+        self._chat_data: Dict[int, Dict] = {}
+        self._user_data: Dict[int, Dict] = {}
+        self._conversations: Dict[str, ConversationDict] = {}
+        self._callback_data: Optional[CDCData] = None
+
+    async def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+
+        def load(conn: sqlite3.Connection) -> Dict[str, list]:
+            conn.execute("PRAGMA journal_mode = WAL")
+            _setup(conn)
+            return {
+                table: conn.execute(f"SELECT * FROM {table}").fetchall()
+                for table in _TABLES
+            }
+
+        rows = await self.db.write(load)
+        if not any(rows.values()) and self.legacy_pickle:
+            await self._import_pickle()
+            return
+
+        self._bot_data = {
+            row["key"]: pickle.loads(row["value"]) for row in rows["bot_data"]
+        }
+        self._chat_data = {
+            row["chat_id"]: pickle.loads(row["value"]) for row in rows["chat_data"]
+        }
+        self._user_data = {
+            row["user_id"]: pickle.loads(row["value"]) for row in rows["user_data"]
+        }
+        for row in rows["conversations"]:
+            key = tuple(json.loads(row["key"]))
+            self._conversations.setdefault(row["name"], {})[key] = pickle.loads(
+                row["state"]
+            )
+        if rows["callback_data"]:
+            self._callback_data = pickle.loads(rows["callback_data"][0]["value"])
+
+    async def _import_pickle(self) -> None:
+        if not os.path.exists(self.legacy_pickle):
+            return
+        logger.info("importing {} into {}".format(self.legacy_pickle, self.filepath))
+        legacy = PicklePersistence(self.legacy_pickle)
+        legacy.set_bot(self.bot)
+
+        await self.update_bot_data(await legacy.get_bot_data() or {})
+        for chat_id, chat_data in (await legacy.get_chat_data() or {}).items():
+            await self.update_chat_data(chat_id, chat_data)
+        for user_id, user_data in (await legacy.get_user_data() or {}).items():
+            await self.update_user_data(user_id, user_data)
+        callback_data = await legacy.get_callback_data()
+        if callback_data:
+            await self.update_callback_data(callback_data)
+        for name, conversations in (legacy.conversations or {}).items():
+            for key, state in conversations.items():
+                await self.update_conversation(name, key, state)
+
+    # Getters
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        await self._load()
+        return deepcopy(self._bot_data)
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        await self._load()
+        return deepcopy(self._chat_data)
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        await self._load()
+        return deepcopy(self._user_data)
+
+    async def get_callback_data(self) -> Optional[CDCData]:
+        await self._load()
+        return deepcopy(self._callback_data)
+
+    async def get_conversations(self, name: str) -> ConversationDict:
+        await self._load()
+        return dict(self._conversations.get(name, {}))
+
+    # Updates
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        changed = {
+            key: value
+            for key, value in data.items()
+            if key not in self._bot_data or self._bot_data[key] != value
+        }
+        removed = [key for key in self._bot_data if key not in data]
+        if not changed and not removed:
+            return
+
+        def query(conn: sqlite3.Connection) -> None:
+            conn.executemany(
+                "INSERT OR REPLACE INTO bot_data (key, value) VALUES (?, ?)",
+                [(key, _dumps(value)) for key, value in changed.items()],
+            )
+            conn.executemany(
+                "DELETE FROM bot_data WHERE key = ?", [(key,) for key in removed]
+            )
+
+        await self.db.write(query)
+        for key in removed:
+            del self._bot_data[key]
+        self._bot_data.update(changed)
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        if self._chat_data.get(chat_id) == data:
+            return
+        await self.db.write(
+            lambda conn: conn.execute(
+                "INSERT OR REPLACE INTO chat_data (chat_id, value) VALUES (?, ?)",
+                (chat_id, _dumps(data)),
+            )
+        )
+        self._chat_data[chat_id] = data
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        if self._user_data.get(user_id) == data:
+            return
+        await self.db.write(
+            lambda conn: conn.execute(
+                "INSERT OR REPLACE INTO user_data (user_id, value) VALUES (?, ?)",
+                (user_id, _dumps(data)),
+            )
+        )
+        self._user_data[user_id] = data
+
+    async def update_callback_data(self, data: CDCData) -> None:
+        if self._callback_data == data:
+            return
+        await self.db.write(
+            lambda conn: conn.execute(
+                "INSERT OR REPLACE INTO callback_data (id, value) VALUES (0, ?)",
+                (_dumps(data),),
+            )
+        )
+        self._callback_data = data
+
+    async def update_conversation(
+        self, name: str, key: ConversationKey, new_state: Optional[object]
+    ) -> None:
+        conversations = self._conversations.setdefault(name, {})
+        if key in conversations and conversations[key] == new_state:
+            return
+        row_key = json.dumps(list(key))
+        if new_state is None:
+            await self.db.write(
+                lambda conn: conn.execute(
+                    "DELETE FROM conversations WHERE name = ? AND key = ?",
+                    (name, row_key),
+                )
+            )
+            conversations.pop(key, None)
+        else:
+            await self.db.write(
+                lambda conn: conn.execute(
+                    "INSERT OR REPLACE INTO conversations (name, key, state) "
+                    "VALUES (?, ?, ?)",
+                    (name, row_key, _dumps(new_state)),
+                )
+            )
+            conversations[key] = new_state
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        await self.db.write(
+            lambda conn: conn.execute(
+                "DELETE FROM chat_data WHERE chat_id = ?", (chat_id,)
+            )
+        )
+        self._chat_data.pop(chat_id, None)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self.db.write(
+            lambda conn: conn.execute(
+                "DELETE FROM user_data WHERE user_id = ?", (user_id,)
+            )
+        )
+        self._user_data.pop(user_id, None)
+
+    # Every update is written as soon as it arrives, so there is nothing to
+    # refresh from or flush to the database besides closing it.
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        await self.db.close()
@@ -0,0 +1,145 @@
+import ast
+import asyncio
+import io
+import tokenize
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import FrozenSet
+
+from fingerprints import Fingerprint, fingerprint
+
+DEFAULT_ENTRY = frozenset({"user_func"})
+
+_LAYOUT_TOKENS = {
+    tokenize.COMMENT,
+    tokenize.NL,
+    tokenize.NEWLINE,
+    tokenize.INDENT,
+    tokenize.DEDENT,
+    tokenize.ENCODING,
+    tokenize.ENDMARKER,
+}
+
+
+class PreflightError(Exception):
+    """Raised with a user-facing message when a submission is rejected."""
+
+
+@dataclass
+class PreflightResult:
+    token_length: int
+    fingerprint: Fingerprint
+
+
+def token_length(code: str) -> int:
+    """Number of significant tokens, ignoring comments, blank lines and layout."""
+    try:
+        tokens = tokenize.generate_tokens(io.StringIO(code).readline)
+        return sum(1 for token in tokens if token.type not in _LAYOUT_TOKENS)
+    except (tokenize.TokenError, SyntaxError):
+        return len(code.split())
+
+
+@lru_cache(maxsize=32)
+def required_names(tests: str) -> FrozenSet[str]:
+    """Names the challenge tests import from user_code."""
+    try:
+        tree = ast.parse(tests)
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        return DEFAULT_ENTRY
+    names = {
+        alias.name
+        for node in ast.walk(tree)
+        if isinstance(node, ast.ImportFrom) and node.module == "user_code"
+        for alias in node.names
+        if alias.name != "*"
+    }
+    return frozenset(names) or DEFAULT_ENTRY
+
+
+def _defined_names(tree: ast.Module) -> set:
+    names = set()
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.ImportFrom) and node.names[0].name == "*":
+            names.add("*")
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.update(
+                (alias.asname or alias.name).split(".")[0] for alias in node.names
+            )
+        elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                names.update(
+                    child.id
+                    for child in ast.walk(target)
+                    if isinstance(child, ast.Name)
+                )
+        else:
+            # Definitions inside top-level if/try/with/for blocks still count
+            names.update(
+                child.name
+                for child in ast.walk(node)
+                if isinstance(
+                    child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+                )
+            )
+    return names
+
+
+def _depth(tree: ast.AST) -> int:
+    deepest = 0
+    stack = [(tree, 1)]
+    while stack:
+        node, depth = stack.pop()
+        deepest = max(deepest, depth)
+        stack.extend((child, depth + 1) for child in ast.iter_child_nodes(node))
+    return deepest
+
+
+def check_submission(
+    code: str,
+    tests: str,
+    max_bytes: int = 64 * 1024,
+    max_nodes: int = 5000,
+    max_depth: int = 100,
+) -> PreflightResult:
+    """Rejects submissions that cannot pass before they reach an executor."""
+    if not code.strip():
+        raise PreflightError("Kod bo'sh")
+    if len(code.encode("utf-8")) > max_bytes:
+        raise PreflightError(
+            f"Kod juda uzun, ruxsat etilgan hajm: {max_bytes // 1024} KB"
+        )
+
+    try:
+        tree = ast.parse(code, filename="user_code.py")
+    except SyntaxError as e:
+        line = (e.text or "").rstrip()
+        pointer = " " * max((e.offset or 1) - 1, 0) + "^"
+        raise PreflightError(
+            f"Sintaksis xatosi, {e.lineno}-qator: {e.msg}\n{line}\n{pointer}"
+        )
+    except ValueError:
+        raise PreflightError("Kodda ruxsat etilmagan belgilar bor")
+    except (RecursionError, MemoryError):
+        raise PreflightError("Kod juda murakkab")
+
+    nodes = sum(1 for _ in ast.walk(tree))
+    if nodes > max_nodes or _depth(tree) > max_depth:
+        raise PreflightError("Kod juda murakkab")
+
+    defined = _defined_names(tree)
+    missing = required_names(tests) - defined
+    if missing and "*" not in defined:
+        raise PreflightError(f"Kodda {', '.join(sorted(missing))} aniqlanmagan")
+
+    return PreflightResult(
+        token_length=token_length(code), fingerprint=fingerprint(code, tree)
+    )
+
+
+async def preflight(code: str, tests: str, **limits: int) -> PreflightResult:
+    """Runs check_submission on a worker thread."""
+    return await asyncio.to_thread(check_submission, code, tests, **limits)
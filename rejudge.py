@@ -0,0 +1,195 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from telegram import Bot
+from telegram.error import TelegramError
+
+from benchmark import build_harness, parse_report
+from database import Database
+from executor import CircuitOpen, ExecutionResult, Executor, ExecutorError
+from metrics import metrics
+from result_cache import ResultCache, tests_digest
+
+logger = logging.getLogger(__name__)
+
+UNITTEST_TIME = re.compile(r"Ran \d+ tests? in (\d+\.\d+)s")
+
+
+class Rejudger:
+    """Re-runs the stored solutions of a challenge against its current tests.
+
+    Solutions are read in id order a page at a time and judged with at most
+    ``concurrency`` executor calls in flight. Every outcome is committed
+    together with a done marker, so a re-judge interrupted by a restart picks
+    up where it stopped instead of starting over. ``on_change`` is called with
+    the challenge id after every stored outcome.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        executor: Executor,
+        result_cache: ResultCache,
+        concurrency: int = 2,
+        benchmark_repeat: int = 5,
+        benchmark_warmup: int = 1,
+        progress_interval: float = 10.0,
+        page_size: int = 50,
+        on_change: Optional[Callable[[int], None]] = None,
+    ) -> None:
+        self.db = db
+        self.executor = executor
+        self.result_cache = result_cache
+        self.concurrency = concurrency
+        self.benchmark_repeat = benchmark_repeat
+        self.benchmark_warmup = benchmark_warmup
+        self.progress_interval = progress_interval
+        self.page_size = page_size
+        self.on_change = on_change
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def running(self, challenge_id: int) -> bool:
+        return challenge_id in self._tasks
+
+    def start(self, bot: Bot, challenge_id: int, chat_id: int) -> None:
+        if challenge_id in self._tasks:
+            return
+        task = asyncio.create_task(
+            self._rejudge(bot, challenge_id, chat_id), name=f"rejudge-{challenge_id}"
+        )
+        self._tasks[challenge_id] = task
+        task.add_done_callback(lambda _: self._finished(challenge_id, task))
+
+    def _finished(self, challenge_id: int, task: asyncio.Task) -> None:
+        self._tasks.pop(challenge_id, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(
+                "re-judge of challenge {} failed".format(challenge_id),
+                exc_info=task.exception(),
+            )
+
+    async def resume(self, bot: Bot) -> None:
+        for row in await self.db.unfinished_rejudges():
+            logger.info("resuming re-judge of challenge {}".format(row["challenge_id"]))
+            self.start(bot, row["challenge_id"], row["chat_id"])
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _execute(self, tests: str, code: str) -> ExecutionResult:
+        execution = await self.result_cache.get(tests, code)
+        if execution is None:
+            execution = await self.executor.run(tests, code)
+            await self.result_cache.put(tests, code, execution)
+        return execution
+
+    async def _judge(
+        self, tests: str, code: str
+    ) -> Tuple[bool, Optional[float], Optional[str]]:
+        execution = await self._execute(tests, code)
+        if not execution.stderr.endswith("OK\n"):
+            return False, None, None
+        match = UNITTEST_TIME.search(execution.stderr)
+        result = float(match.group(1)) if match else execution.duration
+        timings = None
+        if self.benchmark_repeat:
+            harness = build_harness(tests, self.benchmark_repeat, self.benchmark_warmup)
+            report = parse_report((await self._execute(harness, code)).stdout)
+            if report:
+                result = report["total"]["median"]
+                timings = json.dumps(report)
+        return True, result, timings
+
+    async def _rejudge_one(
+        self, semaphore: asyncio.Semaphore, challenge_id: int, tests: str, row
+    ) -> Optional[bool]:
+        """Returns whether the solution still passes, None if it could not run."""
+        async with semaphore:
+            try:
+                accepted, result, timings = await self._judge(
+                    tests, row["solution"] or ""
+                )
+            except ExecutorError as e:
+                logger.warning("could not re-judge solver {}: {}".format(row["id"], e))
+                metrics.inc("rejudge_errors_total")
+                if isinstance(e, CircuitOpen):
+                    await asyncio.sleep(e.retry_after)
+                return None
+        await self.db.apply_rejudge(
+            challenge_id, row["id"], row["chat_id"], accepted, result, timings
+        )
+        metrics.inc("rejudged_total", accepted=accepted)
+        if self.on_change is not None:
+            self.on_change(challenge_id)
+        return accepted
+
+    async def _report(self, bot: Bot, chat_id: int, message_id: int, text: str) -> None:
+        try:
+            await bot.edit_message_text(text, chat_id, message_id)
+        except TelegramError as e:
+            logger.warning("could not update re-judge progress: {}".format(e))
+
+    async def _rejudge(self, bot: Bot, challenge_id: int, chat_id: int) -> None:
+        challenge = await self.db.get_challenge(challenge_id)
+        if challenge is None or not challenge["tests"]:
+            await bot.send_message(chat_id, f"Challenge {challenge_id} has no tests")
+            return
+        tests = challenge["tests"]
+        resumed = await self.db.start_rejudge(
+            challenge_id, tests_digest(tests), chat_id
+        )
+        total = await self.db.count_rejudge_candidates(challenge_id)
+        header = f"Re-judging challenge {challenge_id}" + (
+            " (resumed)" if resumed else ""
+        )
+        message = await bot.send_message(chat_id, f"{header}: 0/{total}")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        passed = failed = errors = 0
+        after_id = 0
+        reported = time.monotonic()
+        while True:
+            rows = await self.db.rejudge_candidates(
+                challenge_id, after_id, self.page_size
+            )
+            if not rows:
+                break
+            after_id = rows[-1]["id"]
+            outcomes = await asyncio.gather(
+                *(
+                    self._rejudge_one(semaphore, challenge_id, tests, row)
+                    for row in rows
+                )
+            )
+            passed += outcomes.count(True)
+            failed += outcomes.count(False)
+            errors += outcomes.count(None)
+            if time.monotonic() - reported >= self.progress_interval:
+                reported = time.monotonic()
+                await self._report(
+                    bot,
+                    chat_id,
+                    message.message_id,
+                    f"{header}: {passed + failed + errors}/{total}, "
+                    f"{passed} passed, {failed} failed, {errors} errors",
+                )
+
+        if errors:
+            text = (
+                f"{header} stopped: {passed} passed, {failed} failed, "
+                f"{errors} could not be run. Send /rejudge {challenge_id} to retry them."
+            )
+        else:
+            summary = await self.db.finish_rejudge(challenge_id)
+            text = (
+                f"{header} finished: {summary['passed']} passed, "
+                f"{summary['failed']} failed and lost their point."
+            )
+        await self._report(bot, chat_id, message.message_id, text)
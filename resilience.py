@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Deque
+
+from executor import CircuitOpen, ExecutionResult, Executor, ExecutorError
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Tracks recent call outcomes and stops calls while the error rate is high.
+
+    The breaker opens once at least ``min_calls`` of the last ``window`` calls
+    were made and ``failure_threshold`` of them failed. After ``reset_timeout``
+    seconds it lets ``half_open_calls`` probes through: one success closes it
+    again, one failure reopens it for another ``reset_timeout``.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: float = 0.5,
+        window: int = 20,
+        min_calls: int = 5,
+        reset_timeout: float = 30.0,
+        half_open_calls: int = 1,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probes = 0
+
+    @property
+    def retry_after(self) -> float:
+        if self.state != OPEN:
+            return 0.0
+        return max(self._opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    def before_call(self) -> None:
+        """Raises CircuitOpen unless a call may go through right now."""
+        if self.state == OPEN:
+            if self.retry_after > 0:
+                raise CircuitOpen(self.retry_after)
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_calls:
+                raise CircuitOpen(self.reset_timeout)
+            self._probes += 1
+
+    def record_success(self) -> None:
+        if self.state == HALF_OPEN:
+            self._outcomes.clear()
+            self._set_state(CLOSED)
+        self._outcomes.append(True)
+
+    def record_failure(self) -> None:
+        if self.state == HALF_OPEN:
+            self._open()
+            return
+        self._outcomes.append(False)
+        failures = self._outcomes.count(False)
+        if (
+            self.state == CLOSED
+            and len(self._outcomes) >= self.min_calls
+            and failures >= self.failure_threshold * len(self._outcomes)
+        ):
+            self._open()
+
+    def record_ignored(self) -> None:
+        """Releases a half-open probe whose outcome says nothing about health."""
+        if self.state == HALF_OPEN:
+            self._probes = max(self._probes - 1, 0)
+
+    def _open(self) -> None:
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._set_state(OPEN)
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.warning("circuit breaker {} -> {}".format(self.state, state))
+            metrics.inc("circuit_transitions_total", state=state)
+        self.state = state
+        self._probes = 0
+
+
+class ResilientExecutor(Executor):
+    """Retries transient failures of another executor behind a circuit breaker.
+
+    A failed run is retried up to ``retries`` times after a full-jitter
+    exponential backoff of at most ``max_delay`` seconds. Every attempt goes
+    through ``breaker``, so during an outage runs fail fast with CircuitOpen
+    instead of adding load to the backend.
+    """
+
+    def __init__(
+        self,
+        executor: Executor,
+        breaker: CircuitBreaker,
+        retries: int = 2,
+        base_delay: float = 0.5,
+        max_delay: float = 5.0,
+    ) -> None:
+        self.executor = executor
+        self.breaker = breaker
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @property
+    def retry_after(self) -> float:
+        return self.breaker.retry_after
+
+    async def start(self) -> None:
+        await self.executor.start()
+
+    async def close(self) -> None:
+        await self.executor.close()
+
+    async def run(self, tests: str, code: str) -> ExecutionResult:
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                result = await self.executor.run(tests, code)
+            except ExecutorError as e:
+                if not e.transient:
+                    self.breaker.record_ignored()
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.retries:
+                    raise
+            except asyncio.CancelledError:
+                self.breaker.record_ignored()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+            delay = random.uniform(
+                0, min(self.max_delay, self.base_delay * 2**attempt)
+            )
+            attempt += 1
+            metrics.inc("executor_retries_total")
+            logger.info(
+                "retrying execution in {:.2f}s (attempt {})".format(delay, attempt)
+            )
+            await asyncio.sleep(delay)
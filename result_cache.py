@@ -0,0 +1,115 @@
+import hashlib
+import io
+import logging
+import time
+import tokenize
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from database import Database
+from executor import ExecutionResult
+
+logger = logging.getLogger(__name__)
+
+_SKIPPED_TOKENS = {tokenize.COMMENT, tokenize.NL, tokenize.ENCODING}
+
+# Outcomes that rerunning the same code gives again: a clean exit or a failed
+# test. Timeouts and kills depend on load and are never cached.
+_REPEATABLE_ERRORS = ("", "Exit code: 1")
+
+
+@lru_cache(maxsize=64)
+def tests_digest(tests: str) -> str:
+    return hashlib.sha256(tests.encode("utf-8")).hexdigest()
+
+
+def normalize_code(code: str) -> str:
+    """Drops comments, blank lines and indentation width from the source.
+
+    Code that cannot be tokenized is only stripped of trailing whitespace, so
+    it still gets a stable key.
+    """
+    try:
+        tokens = tokenize.generate_tokens(io.StringIO(code).readline)
+        return "\n".join(
+            f"{token.type}:{token.string if token.type != tokenize.INDENT else ''}"
+            for token in tokens
+            if token.type not in _SKIPPED_TOKENS
+        )
+    except (tokenize.TokenError, SyntaxError):
+        return "\n".join(line.rstrip() for line in code.strip().splitlines())
+
+
+def cache_key(tests: str, code: str) -> str:
+    normalized = normalize_code(code).encode("utf-8")
+    digest = hashlib.sha256(tests_digest(tests).encode("ascii") + b"\0" + normalized)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Two-tier cache of execution results keyed on tests and normalized code.
+
+    Recent results live in an in-memory LRU, everything else in the
+    ``judge_cache`` table so hits survive restarts. Both tiers expire entries
+    after ``ttl`` seconds. Timeouts and kills are not cached, a rerun may pass.
+    """
+
+    def __init__(self, db: Database, max_entries: int = 1024, ttl: float = 86400):
+        self.db = db
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, Tuple[float, ExecutionResult]]" = OrderedDict()
+
+    def _remember(self, key: str, created: float, result: ExecutionResult) -> None:
+        self._memory[key] = (created, result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, tests: str, code: str) -> Optional[ExecutionResult]:
+        key = cache_key(tests, code)
+        now = time.time()
+
+        cached = self._memory.get(key)
+        if cached is not None:
+            created, result = cached
+            if now - created < self.ttl:
+                self._memory.move_to_end(key)
+                return result
+            del self._memory[key]
+
+        row = await self.db.get_cached_result(key)
+        if row is None:
+            return None
+        if now - row["created"] >= self.ttl:
+            await self.db.delete_cached_result(key)
+            return None
+        result = ExecutionResult(
+            stdout=row["stdout"],
+            stderr=row["stderr"],
+            error=row["error"],
+            duration=row["duration"],
+        )
+        self._remember(key, row["created"], result)
+        return result
+
+    async def put(self, tests: str, code: str, result: ExecutionResult) -> None:
+        if result.error not in _REPEATABLE_ERRORS:
+            return
+        key = cache_key(tests, code)
+        created = time.time()
+        self._remember(key, created, result)
+        await self.db.store_cached_result(
+            key,
+            tests_digest(tests),
+            result.stdout,
+            result.stderr,
+            result.error,
+            result.duration,
+            created,
+        )
+
+    async def clear(self) -> None:
+        self._memory.clear()
+        await self.db.clear_cached_results()
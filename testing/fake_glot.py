@@ -0,0 +1,162 @@
+"""Local stand-in for GLOT_URL with configurable latency and error rates.
+
+Run standalone with ``python testing/fake_glot.py --port 8088`` or start it
+from the load test. Submissions whose user code contains ``ACCEPT_MARKER``
+pass, everything else fails like a real unittest run would.
+"""
+import argparse
+import asyncio
+import json
+import random
+from typing import Optional
+
+ACCEPT_MARKER = "return 3"
+BENCHMARK_MARKER = "BENCHMARK_REPORT "
+BATCH_MARKER = "BATCH_REPORT "
+
+OK_OUTPUT = (
+    "test_1 (__main__.CodeTest.test_1) ... ok\n\n"
+    "----------------------------------------------------------------------\n"
+    "Ran 1 test in 0.{:03d}s\n\nOK\n"
+)
+FAIL_OUTPUT = (
+    "test_1 (__main__.CodeTest.test_1) ... FAIL\n\n"
+    "======================================================================\n"
+    "FAIL: test_1 (__main__.CodeTest.test_1)\n"
+    "----------------------------------------------------------------------\n"
+    "Traceback (most recent call last):\n"
+    '  File "/home/glot/tests.py", line 7, in test_1\n'
+    "    self.assertEqual(user_func(), 3)\n"
+    "AssertionError: 4 != 3\n\n"
+    "----------------------------------------------------------------------\n"
+    "Ran 1 test in 0.001s\n\nFAILED (failures=1)\n"
+)
+
+
+class FakeGlot:
+    """HTTP/1.1 keep-alive server answering glot run requests.
+
+    Latency is log-normal around ``latency`` seconds with shape ``jitter``;
+    ``error_rate`` of the requests get a 503 instead of a result.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.3,
+        jitter: float = 0.5,
+        error_rate: float = 0.0,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/run"
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def _respond(self, body: bytes) -> tuple:
+        if random.random() < self.error_rate:
+            return "503 Service Unavailable", {"message": "overloaded"}
+        files = {f["name"]: f["content"] for f in json.loads(body)["files"]}
+        tests = files.get("tests.py", "")
+        code = files.get("user_code.py", "")
+        if BATCH_MARKER not in tests:
+            return "200 OK", self._run(tests, code)
+        results = [self._run(tests, solution) for solution in json.loads(code)]
+        for result in results:
+            result["duration"] = random.uniform(0.05, 0.2)
+        return "200 OK", {
+            "stdout": BATCH_MARKER + json.dumps(results) + "\n",
+            "stderr": "",
+            "error": "",
+        }
+
+    @staticmethod
+    def _run(tests: str, code: str) -> dict:
+        if ACCEPT_MARKER not in code:
+            return {"stdout": "", "stderr": FAIL_OUTPUT, "error": "Exit code: 1"}
+        if BENCHMARK_MARKER in tests:
+            median = random.uniform(1e-5, 1e-4)
+            total = {"min": median * 0.9, "median": median, "stddev": median / 10}
+            report = {"ok": True, "tests": {"CodeTest.test_1": total}, "total": total}
+            return {
+                "stdout": BENCHMARK_MARKER + json.dumps(report) + "\n",
+                "stderr": "",
+                "error": "",
+            }
+        stderr = OK_OUTPUT.format(random.randint(1, 999))
+        return {"stdout": "", "stderr": stderr, "error": ""}
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                length = 0
+                while line := (await reader.readline()).strip():
+                    name, _, value = line.partition(b":")
+                    if name.lower() == b"content-length":
+                        length = int(value)
+                body = await reader.readexactly(length)
+
+                self.requests += 1
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                try:
+                    await asyncio.sleep(
+                        random.lognormvariate(0, self.jitter) * self.latency
+                    )
+                    status, response = self._respond(body)
+                finally:
+                    self.in_flight -= 1
+
+                payload = json.dumps(response).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode("ascii") + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    glot = FakeGlot(
+        args.host, args.port, args.latency_ms / 1000, args.jitter, args.error_rate
+    )
+    await glot.start()
+    print(f"fake glot listening on {glot.url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    asyncio.run(_serve(parser.parse_args()))
@@ -0,0 +1,257 @@
+"""Load test for code_handler and the leaderboards against a fake glot.
+
+Drives the real handlers from main.py with synthetic updates from N simulated
+users, a stubbed Bot and testing/fake_glot.py instead of GLOT_URL, then
+reports throughput, latency percentiles and database timings. Runs in a
+temporary directory, so the real code_checker.db is never touched.
+
+    python testing/load_test.py --users 200 --submissions 5 --save-baseline base.json
+    python testing/load_test.py --users 200 --submissions 5 --baseline base.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, List
+
+from telegram import Chat, Message, Update, User
+
+from fake_glot import ACCEPT_MARKER, FakeGlot
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTS = open(os.path.join(ROOT, "testing", "default_tests.py")).read()
+
+ACCEPTED_CODE = "def user_func():\n    " + ACCEPT_MARKER + "\n"
+REJECTED_CODE = "def user_func():\n    return 4\n"
+
+
+class FakeBot:
+    """Answers the Bot calls the handlers make after a fixed delay."""
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.username = "load_test_bot"
+        self.sent = 0
+
+    async def _call(self, **kwargs) -> None:
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+
+    async def send_message(self, chat_id, text, **kwargs) -> None:
+        await self._call()
+
+    async def send_photo(self, chat_id, photo, **kwargs) -> None:
+        await self._call()
+
+
+class LoadTest:
+    def __init__(self, main, args: argparse.Namespace) -> None:
+        self.main = main
+        self.args = args
+        self.bot = FakeBot(args.telegram_latency_ms / 1000)
+        self.bot_data: Dict = {}
+        self.chat_data: Dict[int, Dict] = {}
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.update_id = 0
+
+    def _update(self, chat_id: int, text: str) -> Update:
+        self.update_id += 1
+        user = User(chat_id, f"User {chat_id}", False, username=f"user{chat_id}")
+        chat = Chat(chat_id, Chat.PRIVATE)
+        message = Message(
+            self.update_id, datetime.now(), chat, from_user=user, text=text
+        )
+        message.set_bot(self.bot)
+        return Update(self.update_id, message=message)
+
+    def _context(self, chat_id: int) -> SimpleNamespace:
+        return SimpleNamespace(
+            bot=self.bot,
+            bot_data=self.bot_data,
+            chat_data=self.chat_data.setdefault(chat_id, {}),
+            user_data={},
+        )
+
+    async def call(self, name: str, handler, chat_id: int, text: str) -> None:
+        started = time.perf_counter()
+        try:
+            await handler(self._update(chat_id, text), self._context(chat_id))
+        except Exception as e:
+            self.errors[f"{name}: {type(e).__name__}"] = (
+                self.errors.get(f"{name}: {type(e).__name__}", 0) + 1
+            )
+        self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+
+    async def simulate_user(self, chat_id: int) -> None:
+        main = self.main
+        await self.call("start_handler", main.start_handler, chat_id, "/start")
+        last_code = None
+        for _ in range(self.args.submissions):
+            if last_code and random.random() < self.args.duplicate_rate:
+                code = last_code
+            elif random.random() < self.args.accept_rate:
+                code = ACCEPTED_CODE + f"# attempt {random.random()}\n"
+            else:
+                code = REJECTED_CODE + f"# attempt {random.random()}\n"
+            last_code = code
+            await self.call("code_handler", main.code_handler, chat_id, code)
+            if random.random() < self.args.leaderboard_rate:
+                await self.call(
+                    "todays_leaderboard_handler",
+                    main.todays_leaderboard_handler,
+                    chat_id,
+                    "/bugungi_top",
+                )
+            if random.random() < self.args.leaderboard_rate:
+                await self.call(
+                    "leaderboard_handler", main.leaderboard_handler, chat_id, "/top"
+                )
+
+    async def run(self) -> dict:
+        main = self.main
+        main.db.setup()
+        await main.db.add_challenge("Load test", "", "", TESTS)
+        app = SimpleNamespace(bot=self.bot, bot_data=self.bot_data)
+        await main.post_init(app)
+
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(self.simulate_user(1000 + i) for i in range(self.args.users))
+        )
+        elapsed = time.perf_counter() - started
+
+        await main.post_shutdown(app)
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> dict:
+        handlers = {}
+        for name, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            handlers[name] = {
+                "count": len(values),
+                "throughput": len(values) / elapsed,
+                "p50": _percentile(values, 0.50),
+                "p95": _percentile(values, 0.95),
+                "p99": _percentile(values, 0.99),
+                "mean": statistics.fmean(values),
+            }
+        db = {}
+        for labels, histogram in self.main.metrics.histograms.get(
+            "db_query_seconds", {}
+        ).items():
+            kind = dict(labels).get("kind", "")
+            db[kind] = {
+                "count": histogram.count,
+                "mean": histogram.sum / histogram.count if histogram.count else 0,
+                "p95_le": histogram.quantile(0.95),
+            }
+        return {
+            "elapsed": elapsed,
+            "handlers": handlers,
+            "db": db,
+            "errors": self.errors,
+            "bot_calls": self.bot.sent,
+        }
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def print_report(report: dict, glot: FakeGlot, baseline: dict = None) -> None:
+    print(f"elapsed: {report['elapsed']:.2f}s, bot calls: {report['bot_calls']}")
+    print(f"glot requests: {glot.requests}, max in flight: {glot.max_in_flight}")
+    print(f"{'handler':28} {'n':>6} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, stats in report["handlers"].items():
+        print(
+            f"{name:28} {stats['count']:>6} {stats['throughput']:>8.1f} "
+            f"{stats['p50']:>8.3f} {stats['p95']:>8.3f} {stats['p99']:>8.3f}"
+        )
+        if baseline and name in baseline["handlers"]:
+            base = baseline["handlers"][name]
+            print(
+                f"{'  vs baseline':28} {'':>6} "
+                f"{stats['throughput'] - base['throughput']:>+8.1f} "
+                f"{stats['p50'] - base['p50']:>+8.3f} "
+                f"{stats['p95'] - base['p95']:>+8.3f} "
+                f"{stats['p99'] - base['p99']:>+8.3f}"
+            )
+    for kind, stats in report["db"].items():
+        print(
+            f"db {kind}: {stats['count']} queries, mean {stats['mean'] * 1000:.2f}ms, "
+            f"p95 <= {stats['p95_le']}s"
+        )
+    for error, count in report["errors"].items():
+        print(f"error {error}: {count}")
+
+
+async def run(args: argparse.Namespace) -> None:
+    glot = FakeGlot(
+        latency=args.glot_latency_ms / 1000,
+        jitter=args.glot_jitter,
+        error_rate=args.glot_error_rate,
+    )
+    await glot.start()
+
+    workdir = tempfile.mkdtemp(prefix="load-test-")
+    os.chdir(workdir)
+    os.environ.update(
+        {
+            "DEVELOPER_CHAT_ID": "1",
+            "PROD_CHANNEL_ID": "2",
+            "GLOT_URL": glot.url,
+            "GLOT_AUTHORIZATION": "load-test",
+            "METRICS_PORT": "0",
+            "JUDGE_BATCH_SIZE": str(args.batch_size),
+        }
+    )
+    sys.path.insert(0, ROOT)
+    import main
+
+    report = await LoadTest(main, args).run()
+    await glot.close()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(f"workdir: {workdir}")
+    print_report(report, glot, baseline)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--submissions", type=int, default=3)
+    parser.add_argument("--accept-rate", type=float, default=0.6)
+    parser.add_argument("--duplicate-rate", type=float, default=0.2)
+    parser.add_argument("--leaderboard-rate", type=float, default=0.5)
+    parser.add_argument("--glot-latency-ms", type=float, default=300)
+    parser.add_argument("--glot-jitter", type=float, default=0.5)
+    parser.add_argument("--glot-error-rate", type=float, default=0.0)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--telegram-latency-ms", type=float, default=50)
+    parser.add_argument("--baseline", help="compare against a saved report")
+    parser.add_argument("--save-baseline", help="write this report as JSON")
+    args = parser.parse_args()
+    if args.baseline:
+        args.baseline = os.path.abspath(args.baseline)
+    if args.save_baseline:
+        args.save_baseline = os.path.abspath(args.save_baseline)
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(args))